@@ -0,0 +1,422 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import standard Python modules.
+import array
+import bisect
+import collections
+import itertools
+import operator
+
+# Days of slack left on each side of the indexed range, so that entering
+# transactions around the current date rarely has to grow the trees.
+_MARGIN = 366
+
+# Days further than this from the indexed range go to the overflow.
+_FAR = 10 * 366
+
+# add_many widens the trees to the days of a batch, unless they would
+# then span more days than this.
+_MAX_DAYS = 200 * 366
+
+
+def _round(total):
+    # Incremental updates leave floating point dust behind, which must
+    # not show up as a negative zero balance.
+    return round(total, 6) + 0.0
+
+
+def _dense_range(counts):
+    # Returns the first and last day of the run of days, none more than
+    # _FAR days after the one before, that holds the most transactions,
+    # given the number of transactions of each day.
+    best = (0, 0, 0)
+    first = previous = None
+    total = 0
+    for day in sorted(counts):
+        if previous is None or day - previous > _FAR:
+            first = day
+            total = 0
+        total += counts[day]
+        if total > best[0]:
+            best = (total, first, day)
+        previous = day
+    return best[1], best[2]
+
+
+class FenwickTree:
+    """Binary indexed tree over a fixed number of slots."""
+
+    def __init__(self, points, typecode='d'):
+        # Linear-time construction from the point values.
+        self.tree = array.array(typecode, points)
+        n = len(self.tree)
+        for i in range(n):
+            j = i | (i + 1)
+            if j < n:
+                self.tree[j] += self.tree[i]
+
+    def __len__(self):
+        return len(self.tree)
+
+    def add(self, i, delta):
+        n = len(self.tree)
+        while i < n:
+            self.tree[i] += delta
+            i |= i + 1
+
+    def prefix(self, i):
+        """Return the sum of slots [0, i)."""
+        total = 0
+        while i > 0:
+            total += self.tree[i - 1]
+            i &= i - 1
+        return total
+
+    def between(self, lo, hi):
+        """Return the sum of slots [lo, hi)."""
+        return self.prefix(hi) - self.prefix(lo)
+
+    def points(self):
+        """Return the point values, undoing the construction."""
+        points = array.array(self.tree.typecode, self.tree)
+        n = len(points)
+        for i in reversed(range(n)):
+            j = i | (i + 1)
+            if j < n:
+                points[j] -= points[i]
+        return points
+
+
+# Running credit and debit totals keyed by date ordinal.
+#
+# One slot per day between the earliest and latest transaction (plus
+# some margin), so "balance before D" and "totals within [start, end)"
+# are prefix queries that cost O(log days) whatever the ledger size.
+#
+# Days more than _FAR days away from the slots, such as a mistyped year,
+# are kept in a sorted overflow list instead of widening the trees by
+# millions of slots. Queries add up the overflow days they cover.
+
+class BalanceIndex:
+    def __init__(self, transactions=()):
+        self._base = 0
+        self._credit_total = FenwickTree(())
+        self._credit_count = FenwickTree((), 'q')
+        self._debit_total = FenwickTree(())
+        self._debit_count = FenwickTree((), 'q')
+        # Overflow day: [credit_total, credit_count, debit_total,
+        # debit_count], and the overflow days in order.
+        self._far = {}
+        self._far_dates = []
+        self._far_count = 0
+        # _rebuild is not tried again until the overflow holds more
+        # transactions than this.
+        self._far_limit = 0
+
+        transactions = list(transactions)
+        self._build([t['date'] for t in transactions],
+                    [t['amount'] for t in transactions],
+                    [t['type'] == 'credit' for t in transactions])
+
+    @classmethod
+    def from_columns(cls, dates, amounts, credits):
+        """Build the index from parallel sequences of date ordinals,
+        amounts and credit flags."""
+        index = cls()
+        index._build(dates, amounts, credits)
+        return index
+
+    @classmethod
+    def from_sorted(cls, dates, amounts, credits):
+        """Build the index from columns already in date order, with 1
+        or 0 credit flags, summing each day's slice at once."""
+        days = {}
+        lo = 0
+        while lo < len(dates):
+            date = dates[lo]
+            hi = bisect.bisect_right(dates, date, lo)
+            day_amounts = amounts[lo:hi]
+            day_credits = credits[lo:hi]
+            credit_count = sum(day_credits)
+            days[date] = [
+                sum(itertools.compress(day_amounts, day_credits)),
+                credit_count,
+                sum(itertools.compress(day_amounts,
+                                       map(operator.not_, day_credits))),
+                hi - lo - credit_count]
+            lo = hi
+        index = cls()
+        if days:
+            index._set_days(days)
+        return index
+
+    def _build(self, dates, amounts, credits):
+        if not dates:
+            return
+
+        first, last = _dense_range(collections.Counter(dates))
+        base = first - _MARGIN
+        size = last + _MARGIN + 1 - base
+        credit_total = [0.0] * size
+        credit_count = [0] * size
+        debit_total = [0.0] * size
+        debit_count = [0] * size
+        for date, amount, credit in zip(dates, amounts, credits):
+            i = date - base
+            if not 0 <= i < size:
+                self._add_far(date, credit, amount, 1)
+            elif credit:
+                credit_total[i] += amount
+                credit_count[i] += 1
+            else:
+                debit_total[i] += amount
+                debit_count[i] += 1
+
+        self._set_trees(base, [credit_total, credit_count, debit_total,
+                               debit_count])
+
+    def _cover(self, first, last):
+        # Widen the trees to hold the days [first, last] and the margin
+        # around them, moving in the overflow days they now cover.
+        size = len(self._credit_total)
+        if size:
+            base = min(self._base, first - _MARGIN)
+            end = max(self._base + size, last + _MARGIN + 1)
+            before = self._base - base
+        else:
+            base = first - _MARGIN
+            end = last + _MARGIN + 1
+            before = 0
+        after = end - base - before - size
+        if not before and not after:
+            return
+
+        columns = []
+        for tree in (self._credit_total, self._credit_count,
+                     self._debit_total, self._debit_count):
+            points = tree.points()
+            padding = array.array(points.typecode, [0])
+            columns.append(padding * before + points + padding * after)
+
+        lo = bisect.bisect_left(self._far_dates, base)
+        hi = bisect.bisect_left(self._far_dates, end)
+        for date in self._far_dates[lo:hi]:
+            sums = self._far.pop(date)
+            self._far_count -= sums[1] + sums[3]
+            for points, value in zip(columns, sums):
+                points[date - base] += value
+        del self._far_dates[lo:hi]
+        self._set_trees(base, columns)
+
+    def _set_trees(self, base, columns):
+        self._base = base
+        self._credit_total = FenwickTree(columns[0])
+        self._credit_count = FenwickTree(columns[1], 'q')
+        self._debit_total = FenwickTree(columns[2])
+        self._debit_count = FenwickTree(columns[3], 'q')
+
+    def _rebuild(self):
+        # Moves the trees to the run of days with the most transactions,
+        # for when the first days indexed were the odd ones out.
+        days = self._far
+        columns = [self._credit_total.points(), self._credit_count.points(),
+                   self._debit_total.points(), self._debit_count.points()]
+        for i in range(len(self._credit_total)):
+            if columns[1][i] or columns[3][i]:
+                days[self._base + i] = [points[i] for points in columns]
+        self._set_days(days)
+        self._far_limit = 2 * self._far_count
+
+    def _set_days(self, days):
+        # Puts the run of days with the most transactions in the trees
+        # and the other days in the overflow, given the sums of each.
+        first, last = _dense_range(
+            {day: sums[1] + sums[3] for day, sums in days.items()})
+        base = first - _MARGIN
+        size = last + _MARGIN + 1 - base
+        columns = [array.array(typecode, [0]) * size
+                   for typecode in 'dqdq']
+        self._far = {}
+        self._far_count = 0
+        for day, sums in days.items():
+            i = day - base
+            if 0 <= i < size:
+                for points, value in zip(columns, sums):
+                    points[i] += value
+            else:
+                self._far[day] = sums
+                self._far_count += sums[1] + sums[3]
+        self._far_dates = sorted(self._far)
+        self._set_trees(base, columns)
+
+    def _slot(self, date):
+        # Returns None for a day that belongs in the overflow.
+        i = date - self._base
+        size = len(self._credit_total)
+        if 0 <= i < size:
+            return i
+        if size and not -_FAR <= i < size + _FAR:
+            return None
+        self._cover(date, date)
+        return date - self._base
+
+    def _add_far(self, date, credit, amount, count):
+        sums = self._far.get(date)
+        if sums is None:
+            sums = self._far[date] = [0.0, 0, 0.0, 0]
+            bisect.insort(self._far_dates, date)
+        k = 0 if credit else 2
+        sums[k] += amount
+        sums[k + 1] += count
+        self._far_count += count
+        if not sums[1] and not sums[3]:
+            del self._far[date]
+            self._far_dates.remove(date)
+
+    def _far_sums(self, start, end):
+        # Sums of the overflow days in [start, end), in the order of
+        # totals().
+        sums = [0.0, 0, 0.0, 0]
+        dates = self._far_dates
+        lo = 0 if start is None else bisect.bisect_left(dates, start)
+        hi = len(dates) if end is None else bisect.bisect_left(dates, end)
+        for date in dates[lo:hi]:
+            for k, value in enumerate(self._far[date]):
+                sums[k] += value
+        return sums
+
+    def _clamp(self, date, default):
+        if date is None:
+            return default
+        return min(max(date - self._base, 0), len(self._credit_total))
+
+    def _update(self, t, sign):
+        i = self._slot(t['date'])
+        if i is None:
+            self._add_far(t['date'], t['type'] == 'credit',
+                          sign * t['amount'], sign)
+            size = len(self._credit_total)
+            count = self._credit_count.prefix(size)
+            count += self._debit_count.prefix(size)
+            if self._far_count > max(self._far_limit, count):
+                self._rebuild()
+        elif t['type'] == 'credit':
+            self._credit_total.add(i, sign * t['amount'])
+            self._credit_count.add(i, sign)
+        else:
+            self._debit_total.add(i, sign * t['amount'])
+            self._debit_count.add(i, sign)
+
+    def add(self, t):
+        self._update(t, 1)
+
+    def remove(self, t):
+        self._update(t, -1)
+
+    def add_many(self, transactions):
+        """Add a batch of transactions, rebuilding the trees once."""
+        transactions = list(transactions)
+        if len(transactions) < 64:
+            for t in transactions:
+                self.add(t)
+            return
+
+        first, last = _dense_range(
+            collections.Counter(t['date'] for t in transactions))
+        size = len(self._credit_total)
+        span = max(last, self._base + size) - min(first, self._base)
+        if not size or span <= _MAX_DAYS:
+            self._cover(first, last)
+
+        base = self._base
+        size = len(self._credit_total)
+        credit_total = self._credit_total.points()
+        credit_count = self._credit_count.points()
+        debit_total = self._debit_total.points()
+        debit_count = self._debit_count.points()
+        outside = []
+        for t in transactions:
+            i = t['date'] - base
+            if not 0 <= i < size:
+                outside.append(t)
+            elif t['type'] == 'credit':
+                credit_total[i] += t['amount']
+                credit_count[i] += 1
+            else:
+                debit_total[i] += t['amount']
+                debit_count[i] += 1
+
+        self._credit_total = FenwickTree(credit_total)
+        self._credit_count = FenwickTree(credit_count, 'q')
+        self._debit_total = FenwickTree(debit_total)
+        self._debit_count = FenwickTree(debit_count, 'q')
+        for t in outside:
+            self.add(t)
+
+    def balance_before(self, date):
+        i = self._clamp(date, 0)
+        balance = self._credit_total.prefix(i) - self._debit_total.prefix(i)
+        if date is not None:
+            far = self._far_sums(None, date)
+            balance += far[0] - far[2]
+        return _round(balance)
+
+    def totals(self, start=None, end=None):
+        """Return (credit_total, credit_count, debit_total, debit_count)
+        for the transactions dated in [start, end)."""
+        size = len(self._credit_total)
+        lo = self._clamp(start, 0)
+        hi = max(lo, self._clamp(end, size))
+        far = self._far_sums(start, end)
+        return (
+            _round(self._credit_total.between(lo, hi) + far[0]),
+            self._credit_count.between(lo, hi) + far[1],
+            _round(self._debit_total.between(lo, hi) + far[2]),
+            self._debit_count.between(lo, hi) + far[3])
+
+
+class PrefixBalanceIndex:
+    """Read-only BalanceIndex over date ordered rows.
+
+    Takes the dates of the rows and running sums before each row: the
+    credit total, the debit total and the number of credits, each one
+    entry longer than dates.
+    """
+
+    def __init__(self, dates, credit_total, debit_total, credit_count):
+        self.dates = dates
+        self._credit_total = credit_total
+        self._debit_total = debit_total
+        self._credit_count = credit_count
+
+    def _row(self, date, default):
+        if date is None:
+            return default
+        return bisect.bisect_left(self.dates, date)
+
+    def balance_before(self, date):
+        i = self._row(date, 0)
+        return _round(self._credit_total[i] - self._debit_total[i])
+
+    def totals(self, start=None, end=None):
+        lo = self._row(start, 0)
+        hi = max(lo, self._row(end, len(self.dates)))
+        credit_count = self._credit_count[hi] - self._credit_count[lo]
+        return (
+            _round(self._credit_total[hi] - self._credit_total[lo]),
+            credit_count,
+            _round(self._debit_total[hi] - self._debit_total[lo]),
+            hi - lo - credit_count)
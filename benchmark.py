@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time the core ledger operations on generated ledgers.
+
+Runs without Gtk or Sugar. Each operation is timed on every ledger
+size and the best of --repeat runs is kept, results are written as JSON
+so that runs can be compared:
+
+    python3 benchmark.py --sizes 1000,100000 --output before.json
+"""
+
+# Import standard Python modules.
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import journal
+import ledger
+from ledger import Ledger
+import testdata
+
+# Generated ledgers end on a fixed date, so every run sees the same data.
+END = datetime.date(2024, 12, 31)
+
+
+def _best(repeat, func):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def check_summaries(size, args):
+    """Raise AssertionError if Ledger.summary changes once the rollup
+    is built, on a ledger that also holds a transaction from before the
+    FOREVER period start."""
+    records = testdata.generate(size, args.seed, args.categories, args.days,
+                                args.credit_ratio, END)
+    records.append({'name': 'Old', 'type': 'credit', 'amount': 10.0,
+                    'date': datetime.date(1899, 12, 31), 'category': ''})
+    book = Ledger()
+    book.create_transactions(records)
+
+    periods = [(period, ledger.get_this_period(period, END))
+               for period in (ledger.DAY, ledger.WEEK, ledger.MONTH,
+                              ledger.YEAR, ledger.FOREVER)]
+    before = [book.summary(period, start) for period, start in periods]
+    book.category_totals(ledger.FOREVER, END, 'debit')
+    after = [book.summary(period, start) for period, start in periods]
+    for (period, start), old, new in zip(periods, before, after):
+        if old != new:
+            raise AssertionError(
+                'Summary of period %d changed with the rollup: %r != %r' %
+                (period, old, new))
+
+
+def run(size, args):
+    timings = {}
+
+    start = time.perf_counter()
+    records = testdata.generate(size, args.seed, args.categories, args.days,
+                                args.credit_ratio, END)
+    timings['generate'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    book = Ledger()
+    book.create_transactions(records)
+    timings['create_transactions'] = time.perf_counter() - start
+    del records
+
+    month = ledger.get_this_period(ledger.MONTH, END)
+    store = book.transactions
+
+    # The register model serves its rows from the visible ids.
+    timings['build_visible_transactions'] = _best(
+        args.repeat, lambda: book.visible_ids(ledger.MONTH, month))
+    timings['build_visible_transactions_forever'] = _best(
+        args.repeat, lambda: book.visible_ids(ledger.FOREVER, month))
+    # The first category query builds the rollup of the whole ledger.
+    start = time.perf_counter()
+    book.category_totals(ledger.FOREVER, month, 'debit')
+    timings['build_rollup'] = time.perf_counter() - start
+
+    timings['update_summary'] = _best(
+        args.repeat, lambda: book.summary(ledger.MONTH, month))
+    timings['budget_totals'] = _best(
+        args.repeat,
+        lambda: book.category_totals(ledger.MONTH, month, 'debit'))
+    timings['chart_totals_forever'] = _best(
+        args.repeat,
+        lambda: book.category_totals(ledger.FOREVER, month, 'debit'))
+
+    # Undo and redo an amount edit in the middle of the ledger.
+    t = store[size // 2]
+    t['amount'] = t['amount'] + 1
+    timings['undo_redo'] = _best(
+        args.repeat, lambda: (book.undo(), book.redo()))
+
+    timings['export_day'] = _best(
+        args.repeat, lambda: book.export_groups('debit', ledger.DAY))
+    timings['export_month'] = _best(
+        args.repeat, lambda: book.export_groups('debit', ledger.MONTH))
+    timings['export_week'] = _best(
+        args.repeat, lambda: book.export_groups('debit', ledger.WEEK))
+    timings['export_month_by_category'] = _best(
+        args.repeat, lambda: book.export_series('debit', ledger.MONTH))
+
+    fd, file_path = tempfile.mkstemp(prefix='finance-benchmark-')
+    os.close(fd)
+    try:
+        timings['write_file'] = _best(
+            args.repeat, lambda: journal.write(book, file_path, 'none'))
+        file_size = os.path.getsize(file_path)
+        timings['read_file'] = _best(
+            args.repeat, lambda: journal.read(file_path))
+
+        codec_sizes = {}
+        for codec in args.codecs.split(','):
+            timings['write_' + codec] = _best(
+                args.repeat, lambda: journal.write(book, file_path, codec))
+            codec_sizes[codec] = os.path.getsize(file_path)
+            timings['read_' + codec] = _best(
+                args.repeat, lambda: journal.read(file_path))
+
+        timings['write_json'] = _best(
+            args.repeat, lambda: journal.write_json(book, file_path))
+        json_size = os.path.getsize(file_path)
+        timings['read_json'] = _best(
+            args.repeat, lambda: journal.read(file_path))
+
+        # Saving one edit only appends it to the operation log.
+        oplog = journal.OpLog(book, file_path, 'none')
+        timings['compact_log'] = _best(args.repeat, oplog.compact)
+
+        def save_edit():
+            t['amount'] = t['amount'] + 1
+            oplog.save()
+        timings['save_edit'] = _best(args.repeat, save_edit)
+    finally:
+        os.remove(file_path)
+
+    return {'size': size, 'file_size': file_size, 'json_size': json_size,
+            'codec_sizes': codec_sizes, 'timings': timings}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='comma separated ledger sizes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--categories', type=int, default=12,
+                        help='number of debit categories')
+    parser.add_argument('--days', type=int, default=3 * 365,
+                        help='date span of the ledger')
+    parser.add_argument('--credit-ratio', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--codecs', default='zlib:1,zlib,lzma:0,bz2',
+                        help='comma separated journal codecs to compare, '
+                        'as name or name:level')
+    parser.add_argument('--output', help='JSON results file')
+    args = parser.parse_args(argv)
+
+    check_summaries(1000, args)
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(',')]:
+        result = run(size, args)
+        results.append(result)
+        for name, seconds in result['timings'].items():
+            print('%10d %-36s %10.6f' % (size, name, seconds))
+        for codec, file_size in result['codec_sizes'].items():
+            print('%10d %-36s %10d' % (size, 'size_' + codec, file_size))
+        sys.stdout.flush()
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'categories': args.categories,
+        'days': args.days,
+        'credit_ratio': args.credit_ratio,
+        'repeat': args.repeat,
+        'results': results
+    }
+    if args.output:
+        fd = open(args.output, 'w')
+        try:
+            json.dump(report, fd, indent=1)
+        finally:
+            fd.close()
+
+
+if __name__ == '__main__':
+    main()
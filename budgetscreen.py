@@ -16,7 +16,6 @@
 
 # Import standard Python modules.
 import datetime
-import locale
 
 from gettext import gettext as _
 
@@ -27,19 +26,9 @@ from gi.repository import GObject
 from sugar3.graphics import style
 
 import colors
+from currency import format_currency
 from parse import evaluate
-
-# copied from finance.py to not create another module
-DAY = 0
-WEEK = 1
-MONTH = 2
-YEAR = 3
-FOREVER = 4
-
-BUDGET_HELP = _(
-    'The Budget view allows you to set a monthly budget for each expense '
-    'category, and to keep track of your\nbudgets. To set a budget, type '
-    'the amount in the box to the right of the category.')
+from ledger import DAY, WEEK, YEAR, FOREVER
 
 
 class BudgetScreen(Gtk.VBox):
@@ -50,6 +39,7 @@ class BudgetScreen(Gtk.VBox):
 
         self.category_total = {}
         self.sorted_categories = []
+        self._build_key = None
 
         self.budgetbox = Gtk.VBox()
 
@@ -61,17 +51,14 @@ class BudgetScreen(Gtk.VBox):
         self.pack_start(scroll, True, True, 0)
 
     def build(self):
-        # Build the category totals.
-        self.category_total = {}
-        for t in self.activity.visible_transactions:
-            cat = t['category']
-            amount = t['amount']
+        key = self.activity.get_view_key()
+        if key == self._build_key:
+            return
+        self._build_key = key
 
-            if t['type'] == 'debit':
-                if cat not in self.category_total:
-                    self.category_total[cat] = amount
-                else:
-                    self.category_total[cat] += amount
+        # Build the category totals.
+        self.category_total = self.activity.ledger.category_totals(
+            self.activity.period, self.activity.period_start, 'debit')
 
         # Generate a list of names sorted by total.
         self.sorted_categories = list(self.category_total.keys())
@@ -151,9 +138,9 @@ class BudgetScreen(Gtk.VBox):
             budgetentry.connect('changed', self.budget_changed_cb, c)
             budgetentry.connect('activate', self.budget_activate_cb, c)
             budgetentry.set_width_chars(10)
-            if c in self.activity.data['budgets']:
-                b = self.activity.data['budgets'][c]
-                budgetentry.set_text(locale.currency(b['amount'], False))
+            if c in self.activity.ledger.budgets:
+                b = self.activity.ledger.budgets[c]
+                budgetentry.set_text(format_currency(b['amount'], False))
             budgetgroup.add_widget(budgetentry)
 
             # freqcombo = Gtk.ComboBoxText()
@@ -201,8 +188,8 @@ class BudgetScreen(Gtk.VBox):
         # Draw arrow and cost.
         total = self.category_total[category]
 
-        if category in self.activity.data['budgets']:
-            budget = self.activity.data['budgets'][category]['amount']
+        if category in self.activity.ledger.budgets:
+            budget = self.activity.ledger.budgets[category]['amount']
 
             # Convert from monthly budget.
             if self.activity.period == DAY:
@@ -234,7 +221,7 @@ class BudgetScreen(Gtk.VBox):
                 cr.set_source_rgb(0.6, 1.0, 0.6)
             cr.fill()
 
-        text = locale.currency(total)
+        text = format_currency(total)
         cr.set_source_rgb(0, 0, 0)
         cr.set_font_size(20)
         x_bearing, y_bearing, width, height = cr.text_extents(text)[:4]
@@ -245,7 +232,7 @@ class BudgetScreen(Gtk.VBox):
         text = widget.get_text()
 
         if text == '':
-            self.activity.data['budgets'][category] = {'amount': 0.0}
+            self.activity.ledger.budgets[category] = {'amount': 0.0}
             return
 
         amount = evaluate(text)
@@ -260,7 +247,7 @@ class BudgetScreen(Gtk.VBox):
             if text != result:
                 widget.set_text(result)
 
-        self.activity.data['budgets'][category] = {'amount': amount}
+        self.activity.ledger.budgets[category] = {'amount': amount}
         self.queue_draw()
 
     def budget_changed_cb(self, widget, category):
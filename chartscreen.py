@@ -16,12 +16,12 @@
 
 # Import standard Python modules.
 import math
-import locale
 import cairo
 import logging
 
 # Import activity module
 import colors
+from currency import format_currency
 
 from gettext import gettext as _
 
@@ -31,10 +31,6 @@ from gi.repository import PangoCairo
 
 from sugar3.graphics import style
 
-CHART_HELP = _(
-    'The Chart view shows the proportion of your expenses that is in each '
-    'category.\nYou can categorize transactions in the Register view.')
-
 
 def _get_screen_dpi():
     xft_dpi = Gtk.Settings.get_default().get_property('gtk-xft-dpi')
@@ -62,6 +58,7 @@ class ChartScreen(Gtk.VBox):
         self.category_total = {}
         self.sorted_categories = []
         self._graph_mode = self.CHART_DEBIT
+        self._build_key = None
 
         header = Gtk.EventBox()
         header.modify_bg(Gtk.StateType.NORMAL,
@@ -86,6 +83,10 @@ class ChartScreen(Gtk.VBox):
         self.build()
 
     def build(self):
+        key = (self.activity.get_view_key(), self._graph_mode)
+        if key == self._build_key:
+            return
+        self._build_key = key
 
         if self._graph_mode == self.CHART_CREDIT:
             self.title = _('Credit Categories')
@@ -97,16 +98,9 @@ class ChartScreen(Gtk.VBox):
             self.title)
 
         # Build the category totals.
-        self.category_total = {}
-        for t in self.activity.visible_transactions:
-            cat = t['category']
-            amount = t['amount']
-
-            if t['type'] == self._graph_mode:
-                if cat not in self.category_total:
-                    self.category_total[cat] = amount
-                else:
-                    self.category_total[cat] += amount
+        self.category_total = self.activity.ledger.category_totals(
+            self.activity.period, self.activity.period_start,
+            self._graph_mode)
 
         # Generate a list of names sorted by total.
         self.sorted_categories = list(self.category_total.keys())
@@ -162,7 +156,7 @@ class ChartScreen(Gtk.VBox):
             max_height = max(max_height, height)
 
             x_bearing, y_bearing, width, height, x_advance, y_advance = \
-                context.text_extents(locale.currency(self.category_total[c]))
+                context.text_extents(format_currency(self.category_total[c]))
             max_height = max(max_height, height)
             max_width_amount = max(max_width_amount, width)
 
@@ -196,7 +190,7 @@ class ChartScreen(Gtk.VBox):
             context.restore()
 
             context.save()
-            text = locale.currency(self.category_total[c])
+            text = format_currency(self.category_total[c])
             x_bearing, y_bearing, width, height, x_advance, y_advance = \
                 context.text_extents(text)
             context.move_to(rectangles_width - x_advance - padding,
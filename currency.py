@@ -0,0 +1,126 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Fast formatting of money amounts, like locale.currency."""
+
+# Import standard Python modules.
+import functools
+import locale
+
+# Formatted values remembered by each formatter.
+CACHE_SIZE = 4096
+
+# frac_digits of a locale without monetary conventions, such as C.
+_NO_CURRENCY = 127
+
+# Stands for the number while the sign and symbol are laid out.
+_NUMBER = '\0'
+
+
+def _layout(conv, negative, symbol):
+    # The steps of locale.currency, run once on a placeholder. Returns
+    # the text before and after the number.
+    s = '<' + _NUMBER + '>'
+    if symbol:
+        smb = conv['currency_symbol']
+        precedes = conv[negative and 'n_cs_precedes' or 'p_cs_precedes']
+        separated = conv[negative and 'n_sep_by_space' or 'p_sep_by_space']
+        if precedes:
+            s = smb + (separated and ' ' or '') + s
+        else:
+            s = s + (separated and ' ' or '') + smb
+
+    sign_pos = conv[negative and 'n_sign_posn' or 'p_sign_posn']
+    sign = conv[negative and 'negative_sign' or 'positive_sign']
+    if sign_pos == 0:
+        s = '(' + s + ')'
+    elif sign_pos == 2:
+        s = s + sign
+    elif sign_pos == 3:
+        s = s.replace('<', sign)
+    elif sign_pos == 4:
+        s = s.replace('>', sign)
+    else:
+        s = sign + s
+    before, after = s.replace('<', '').replace('>', '').split(_NUMBER)
+    return before, after
+
+
+# Formats amounts the way locale.currency(value, symbol) does, without
+# grouping, for the locale current when the formatter was made.
+#
+# The monetary conventions are read and laid out once, for positive and
+# negative amounts with and without the symbol, instead of on every
+# call. format() also remembers its last CACHE_SIZE results, which suits
+# the same totals being drawn over and over; format_many() skips that
+# cache, for exports where every value is different.
+
+class CurrencyFormatter:
+    def __init__(self, cache_size=CACHE_SIZE):
+        conv = locale.localeconv()
+        self.digits = conv['frac_digits']
+        self._decimal_point = conv['mon_decimal_point']
+        self._number = '%%.%df' % self.digits
+        self._layouts = {(negative, symbol): _layout(conv, negative, symbol)
+                         for negative in (False, True)
+                         for symbol in (False, True)}
+        self.format = functools.lru_cache(cache_size)(self._format)
+
+    def _format(self, value, symbol=True):
+        if self.digits == _NO_CURRENCY:
+            raise ValueError('Currency formatting is not possible using '
+                             "the 'C' locale.")
+        number = self._number % abs(value)
+        if self._decimal_point != '.':
+            number = number.replace('.', self._decimal_point)
+        before, after = self._layouts[value < 0, symbol]
+        return before + number + after
+
+    def format_cents(self, cents, symbol=True):
+        """Format an amount given as an integer number of cents."""
+        if self.digits != 2:
+            return self.format(cents / 100, symbol)
+        units, rest = divmod(abs(cents), 100)
+        before, after = self._layouts[cents < 0, symbol]
+        return '%s%d%s%02d%s' % (before, units, self._decimal_point, rest,
+                                 after)
+
+    def format_many(self, values, symbol=True):
+        """Return the formatted values as a list."""
+        format = self._format
+        return [format(value, symbol) for value in values]
+
+
+_formatter = None
+
+
+def get_formatter():
+    """Return the formatter shared by all the screens."""
+    global _formatter
+    if _formatter is None:
+        _formatter = CurrencyFormatter()
+    return _formatter
+
+
+def reset():
+    """Forget the shared formatter, after the locale changed."""
+    global _formatter
+    _formatter = None
+
+
+def format_currency(value, symbol=True):
+    """Like locale.currency(value, symbol), through the shared
+    formatter."""
+    return get_formatter().format(value, symbol)
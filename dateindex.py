@@ -0,0 +1,158 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import standard Python modules.
+import array
+import bisect
+import itertools
+import operator
+
+# Transaction ids live in the low bits of each key, the date ordinal in
+# the high bits, so sorting the keys sorts by (date, id).
+_ID_BITS = 32
+_ID_MASK = (1 << _ID_BITS) - 1
+
+# add_many inserts batches smaller than this one key at a time. Batches
+# bigger than 1/_BATCH_RATIO of the index are merged by sorting, others
+# are spliced in between slices of the keys.
+_BATCH_SIZE = 64
+_BATCH_RATIO = 16
+
+
+def _key(date, id):
+    return (date << _ID_BITS) | id
+
+
+# A persistent index of transaction ids ordered by date.
+#
+# The keys are kept sorted in a flat array, so looking up the
+# transactions of a period is two binary searches and a slice, instead
+# of a scan of the whole ledger followed by a sort.
+
+class DateIndex:
+    def __init__(self, transactions=()):
+        self.keys = array.array('q', sorted(
+            _key(t['date'], t['id']) for t in transactions))
+
+    @classmethod
+    def from_sorted(cls, dates, ids):
+        """Build the index from parallel date and id columns already in
+        (date, id) order, without sorting them again."""
+        index = cls()
+        index.keys = array.array('q', map(
+            operator.or_,
+            map(operator.lshift, dates, itertools.repeat(_ID_BITS)), ids))
+        return index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, id, date):
+        bisect.insort(self.keys, _key(date, id))
+
+    def add_many(self, pairs):
+        """Add (id, date) pairs, merging them in when there are many."""
+        new = sorted(_key(d, id) for id, d in pairs)
+        keys = self.keys
+        if len(new) < _BATCH_SIZE:
+            for key in new:
+                bisect.insort(keys, key)
+        elif len(new) * _BATCH_RATIO > len(keys):
+            # Sorting two sorted runs is a single merge.
+            self.keys = array.array('q', sorted(keys + array.array('q', new)))
+        else:
+            merged = array.array('q')
+            lo = 0
+            for key in new:
+                i = bisect.bisect_right(keys, key, lo)
+                merged += keys[lo:i]
+                merged.append(key)
+                lo = i
+            merged += keys[lo:]
+            self.keys = merged
+
+    def remove(self, id, date):
+        key = _key(date, id)
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+
+    def bounds(self, start=None, end=None):
+        """Return the slice of keys dated in [start, end)."""
+        lo = 0
+        hi = len(self.keys)
+        if start is not None:
+            lo = bisect.bisect_left(self.keys, _key(start, 0))
+        if end is not None:
+            hi = bisect.bisect_left(self.keys, _key(end, 0))
+        return lo, max(lo, hi)
+
+    def ids(self, start=None, end=None):
+        """Return the ids dated in [start, end), in date order."""
+        lo, hi = self.bounds(start, end)
+        return [key & _ID_MASK for key in self.keys[lo:hi]]
+
+    def iter_ids(self, start=None, end=None):
+        """Like ids, without building the list. The index must not
+        change while iterating."""
+        lo, hi = self.bounds(start, end)
+        keys = self.keys
+        for i in range(lo, hi):
+            yield keys[i] & _ID_MASK
+
+    def span(self, start=None, end=None):
+        """Return the first and last date in [start, end), or None."""
+        lo, hi = self.bounds(start, end)
+        if lo == hi:
+            return None
+        return self.keys[lo] >> _ID_BITS, self.keys[hi - 1] >> _ID_BITS
+
+
+class SortedDateIndex:
+    """Read-only DateIndex over parallel date and id columns that are
+    already in (date, id) order, such as the columns of a mapped
+    journal snapshot."""
+
+    def __init__(self, dates, ids):
+        self.dates = dates
+        self._ids = ids
+
+    def __len__(self):
+        return len(self.dates)
+
+    def bounds(self, start=None, end=None):
+        lo = 0
+        hi = len(self.dates)
+        if start is not None:
+            lo = bisect.bisect_left(self.dates, start)
+        if end is not None:
+            hi = bisect.bisect_left(self.dates, end)
+        return lo, max(lo, hi)
+
+    def ids(self, start=None, end=None):
+        lo, hi = self.bounds(start, end)
+        return self._ids[lo:hi].tolist()
+
+    def iter_ids(self, start=None, end=None):
+        lo, hi = self.bounds(start, end)
+        ids = self._ids
+        for i in range(lo, hi):
+            yield ids[i]
+
+    def span(self, start=None, end=None):
+        lo, hi = self.bounds(start, end)
+        if lo == hi:
+            return None
+        return self.dates[lo], self.dates[hi - 1]
@@ -0,0 +1,169 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Writing the register to CSV, OFX and QIF files.
+
+Transactions are streamed from the date index straight to the file, so
+exporting takes the same memory whatever the size of the ledger.
+Amounts are formatted with currency.CurrencyFormatter, like the
+register does.
+"""
+
+# Import standard Python modules.
+import csv
+import datetime
+import locale
+from xml.sax.saxutils import escape
+
+from currency import get_formatter
+from ledger import FOREVER
+
+# Lines are written to the file in batches of this many.
+BATCH_SIZE = 1024
+
+
+def _signed(t):
+    if t['type'] == 'credit':
+        return t['amount']
+    return -t['amount']
+
+
+def _transactions(book, ids):
+    transactions = book.transactions
+    for id in ids:
+        yield transactions[id]
+
+
+def _formatted(book, ids):
+    # Yields (transaction, amount text), formatting a batch of amounts
+    # at a time.
+    formatter = get_formatter()
+    batch = []
+    for t in _transactions(book, ids):
+        batch.append(t)
+        if len(batch) == BATCH_SIZE:
+            amounts = formatter.format_many([_signed(t) for t in batch],
+                                            False)
+            yield from zip(batch, amounts)
+            batch = []
+    amounts = formatter.format_many([_signed(t) for t in batch], False)
+    yield from zip(batch, amounts)
+
+
+def _csv_rows(book, ids):
+    yield ['Date', 'Name', 'Category', 'Type', 'Amount']
+    for t, amount in _formatted(book, ids):
+        yield [datetime.date.fromordinal(t['date']).isoformat(), t['name'],
+               t['category'], t['type'], amount]
+
+
+def _qif_lines(book, ids):
+    yield '!Type:Bank\n'
+    for t, amount in _formatted(book, ids):
+        date = datetime.date.fromordinal(t['date'])
+        yield 'D%02d/%02d/%04d\nT%s\nP%s\nL%s\n^\n' % (
+            date.month, date.day, date.year, amount,
+            t['name'].replace('\n', ' '), t['category'].replace('\n', ' '))
+
+
+def _ofx_date(date):
+    return datetime.date.fromordinal(date).strftime('%Y%m%d')
+
+
+def _ofx_lines(book, ids, span, balance):
+    # OFX amounts always use a dot, whatever the locale.
+    conventions = locale.localeconv()
+    currency = conventions['int_curr_symbol'].strip() or 'USD'
+    first, last = span or (datetime.date.today().toordinal(),) * 2
+
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<?OFX OFXHEADER="200" VERSION="211" SECURITY="NONE" '
+           'OLDFILEUID="NONE" NEWFILEUID="NONE"?>\n'
+           '<OFX>\n<BANKMSGSRSV1>\n<STMTTRNRS>\n<TRNUID>0</TRNUID>\n'
+           '<STATUS><CODE>0</CODE><SEVERITY>INFO</SEVERITY></STATUS>\n'
+           '<STMTRS>\n<CURDEF>%s</CURDEF>\n'
+           '<BANKACCTFROM><BANKID>0</BANKID><ACCTID>0</ACCTID>'
+           '<ACCTTYPE>CHECKING</ACCTTYPE></BANKACCTFROM>\n'
+           '<BANKTRANLIST>\n<DTSTART>%s</DTSTART>\n<DTEND>%s</DTEND>\n'
+           % (escape(currency), _ofx_date(first), _ofx_date(last)))
+    for t in _transactions(book, ids):
+        yield ('<STMTTRN><TRNTYPE>%s</TRNTYPE><DTPOSTED>%s</DTPOSTED>'
+               '<TRNAMT>%.2f</TRNAMT><FITID>%d</FITID><NAME>%s</NAME>'
+               '<MEMO>%s</MEMO></STMTTRN>\n' % (
+                   t['type'].upper(), _ofx_date(t['date']), _signed(t),
+                   t['id'], escape(t['name'][:32]), escape(t['category'])))
+    yield ('</BANKTRANLIST>\n'
+           '<LEDGERBAL><BALAMT>%.2f</BALAMT><DTASOF>%s</DTASOF></LEDGERBAL>\n'
+           '</STMTRS>\n</STMTTRNRS>\n</BANKMSGSRSV1>\n</OFX>\n'
+           % (balance, _ofx_date(last)))
+
+
+def _write_lines(fd, lines):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == BATCH_SIZE:
+            fd.write(''.join(batch))
+            batch = []
+    fd.write(''.join(batch))
+
+
+def write_csv(book, fd, ids):
+    csv.writer(fd).writerows(_csv_rows(book, ids))
+
+
+def write_qif(book, fd, ids):
+    _write_lines(fd, _qif_lines(book, ids))
+
+
+def write_ofx(book, fd, ids, span=None):
+    """Write an OFX statement; span is the first and last date ordinal
+    of the transactions."""
+    if span is None:
+        balance = 0.0
+    else:
+        balance = book.transactions.balance_index.balance_before(span[1] + 1)
+    _write_lines(fd, _ofx_lines(book, ids, span, balance))
+
+
+# Format name: (mime type, file name suffix).
+FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'ofx': ('application/x-ofx', '.ofx'),
+    'qif': ('application/qif', '.qif'),
+}
+
+
+def export(book, file_path, format, period=FOREVER, period_start=None):
+    """Write the transactions of a period, or all of them, to file_path
+    in one of FORMATS."""
+    if format not in FORMATS:
+        raise ValueError('Unknown export format %r' % format)
+    if period_start is None:
+        period = FOREVER
+        period_start = datetime.date.today()
+    ids = book.iter_visible_ids(period, period_start)
+
+    fd = open(file_path, 'w', newline='', encoding='utf-8')
+    try:
+        if format == 'csv':
+            write_csv(book, fd, ids)
+        elif format == 'qif':
+            write_qif(book, fd, ids)
+        else:
+            write_ofx(book, fd, ids,
+                      book.visible_span(period, period_start))
+    finally:
+        fd.close()
@@ -18,21 +18,23 @@
 """Finance - Home financial software for the OLPC XO."""
 
 # Import standard Python modules.
+import time
+# Taken before the other imports, so the startup trace includes them.
+_START_TIME = time.monotonic()
+
 import os
 import logging
 import datetime
 import locale
 from gettext import gettext as _
 import json
-import tempfile
 import io
-import dbus
-import copy
 
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('PangoCairo', '1.0')
 from gi.repository import Gtk
+from gi.repository import GLib
 from gi.repository import Pango
 
 # Import Sugar UI modules.
@@ -46,19 +48,24 @@ from sugar3.activity.widgets import ActivityToolbarButton
 from sugar3.activity.widgets import RedoButton
 from sugar3.activity.widgets import UndoButton
 from sugar3.activity import activity
-from sugar3.datastore import datastore
 from sugar3.graphics.alert import Alert
 from sugar3.graphics.icon import Icon
 from sugar3.graphics.palettemenu import PaletteMenuItem
 from sugar3.graphics.palettemenu import PaletteMenuBox
+from sugar3.graphics.palettemenu import PaletteMenuItemSeparator
 from sugar3 import profile
 
 # Import screen classes.
 import registerscreen
-import chartscreen
-import budgetscreen
+import testdata
+from ledger import Ledger
+import journal
+from ledger import DAY, WEEK, MONTH, YEAR, FOREVER
+import ledger
 from helpbutton import HelpButton
+import helptext
 import colors
+from currency import format_currency
 from filtertoolitem import FilterToolItem
 import emptypanel
 
@@ -73,11 +80,17 @@ log = logging.getLogger('Finance')
 log.setLevel(logging.DEBUG)
 logging.basicConfig()
 
-DAY = 0
-WEEK = 1
-MONTH = 2
-YEAR = 3
-FOREVER = 4
+# FINANCE_TRACE_STARTUP=1 logs how long startup takes to reach each step.
+_TRACE_STARTUP = bool(os.getenv('FINANCE_TRACE_STARTUP'))
+
+
+def _trace(step):
+    if _TRACE_STARTUP:
+        log.debug('startup: %s after %.3fs', step,
+                  time.monotonic() - _START_TIME)
+
+
+_trace('modules imported')
 
 
 # This is the main Finance activity class.
@@ -87,44 +100,39 @@ FOREVER = 4
 # active screen on top.
 
 class Finance(activity.Activity):
+
+    # Parts of the screen that are rebuilt when stale, see invalidate().
+    DIRTY_VISIBLE = 1
+    DIRTY_SUMMARY = 2
+    DIRTY_PANEL = 4
+    DIRTY_HEADER = 8
+    DIRTY_ALL = DIRTY_VISIBLE | DIRTY_SUMMARY | DIRTY_PANEL | DIRTY_HEADER
+
     def __init__(self, handle):
         activity.Activity.__init__(self, handle)
+        _trace('activity initialized')
         self.set_title(_("Finance"))
         self.max_participants = 1
 
         # Initialize database.
-        # data
-        #   next_id
-        #   transactions
-        #     id, name, type, amount, date, category
-        #   budgets
-        #     category, period, amount, budget
-        self.data = {
-            'next_id': 0,
-            'transactions': [],
-            'budgets': {}
-        }
-
-        self.transaction_map = {}
-        self.visible_transactions = []
-
-        self.undo_transaction_map = []
-        self.undo_id_map = []
-
-        self.redo_id_map = []
-        self.redo_transaction_map = []
-
-        self.transaction_names = {}
-        self.category_names = {}
+        self.set_ledger(Ledger())
+        self._oplog = None
+        self._saving = False
+        self._importer = None
+        self._import_object = None
+        self._import_alert = None
+        self.visible_ids = []
+        self._visible_key = None
 
         # Initialize view period to the first of the month.
         self.period = MONTH
         self.period_start = self.get_this_period()
 
-        # Create screens.
+        # Create screens. The budget and chart screens are only created
+        # once they are first shown, see the budget and chart properties.
         self.register = registerscreen.RegisterScreen(self)
-        self.chart = chartscreen.ChartScreen(self)
-        self.budget = budgetscreen.BudgetScreen(self)
+        self._budget = None
+        self._chart = None
 
         self.build_toolbox()
 
@@ -133,6 +141,9 @@ class Finance(activity.Activity):
         self.headerbox = self.build_header()
         self._active_panel = None
 
+        self._dirty = 0
+        self._rebuild_id = None
+
         # Add the summary data.
 
         self.startlabel = Gtk.Label()
@@ -188,11 +199,37 @@ class Finance(activity.Activity):
 
         self.show_all()
         self.show_header_controls()
-
-        if os.getenv('FINANCE_TEST'):
-            self.create_test_data()
+        _trace('canvas shown')
+        if _TRACE_STARTUP:
+            self._first_draw_id = vbox.connect('draw', self.__first_draw_cb)
+
+        # FINANCE_TEST=<count> generates a ledger of that size instead.
+        test = os.getenv('FINANCE_TEST')
+        if test:
+            if test.isdigit():
+                self.create_transactions(testdata.generate(int(test)))
+            else:
+                self.create_test_data()
             self._set_internal_panel(self.register)
 
+    def __first_draw_cb(self, widget, cr):
+        widget.disconnect(self._first_draw_id)
+        _trace('first paint')
+
+    @property
+    def budget(self):
+        if self._budget is None:
+            import budgetscreen
+            self._budget = budgetscreen.BudgetScreen(self)
+        return self._budget
+
+    @property
+    def chart(self):
+        if self._chart is None:
+            import chartscreen
+            self._chart = chartscreen.ChartScreen(self)
+        return self._chart
+
     def build_toolbox(self):
 
         view_tool_group = None
@@ -248,10 +285,18 @@ class Finance(activity.Activity):
         self.toolbar_box.toolbar.insert(StopButton(self), -1)
         self.set_toolbar_box(self.toolbar_box)
 
+        activity_button.page.insert(self._create_import_button(), -1)
         activity_button.page.insert(self._create_export_button(), -1)
 
         self.toolbar_box.show_all()
 
+    def _create_import_button(self):
+        import_data = ToolButton('document-open')
+        import_data.props.tooltip = _('Import a bank statement')
+        import_data.connect('clicked', self.__import_cb)
+        import_data.show()
+        return import_data
+
     def _create_export_button(self):
         # Add expoprt button
         export_data = ToolButton('save-as-data')
@@ -264,25 +309,35 @@ class Finance(activity.Activity):
         menu_box = PaletteMenuBox()
         export_data.props.palette.set_content(menu_box)
 
-        menu_item = PaletteMenuItem(text_label=_('Export credits by day'))
-        menu_item.connect('activate', self.__export_data_to_chart_cb,
-                          'credit', DAY)
-        menu_box.append_item(menu_item)
-
-        menu_item = PaletteMenuItem(text_label=_('Export debits by day'))
-        menu_item.connect('activate', self.__export_data_to_chart_cb,
-                          'debit', DAY)
-        menu_box.append_item(menu_item)
-
-        menu_item = PaletteMenuItem(text_label=_('Export credits by month'))
-        menu_item.connect('activate', self.__export_data_to_chart_cb,
-                          'credit', MONTH)
-        menu_box.append_item(menu_item)
-
-        menu_item = PaletteMenuItem(text_label=_('Export debits by month'))
-        menu_item.connect('activate', self.__export_data_to_chart_cb,
-                          'debit', MONTH)
-        menu_box.append_item(menu_item)
+        items = (
+            ('credit', DAY, _('Export credits by day')),
+            ('debit', DAY, _('Export debits by day')),
+            ('credit', WEEK, _('Export credits by week')),
+            ('debit', WEEK, _('Export debits by week')),
+            ('credit', MONTH, _('Export credits by month')),
+            ('debit', MONTH, _('Export debits by month')),
+            ('credit', YEAR, _('Export credits by year')),
+            ('debit', YEAR, _('Export debits by year')))
+        for type_movement, period, label in items:
+            menu_item = PaletteMenuItem(text_label=label)
+            menu_item.connect('activate', self.__export_data_to_chart_cb,
+                              type_movement, period)
+            menu_box.append_item(menu_item)
+
+        self._export_by_category = Gtk.CheckButton(
+            label=_('One chart per category'))
+        menu_box.append_item(self._export_by_category)
+
+        menu_box.append_item(PaletteMenuItemSeparator())
+
+        items = (
+            ('csv', _('Export register as CSV')),
+            ('ofx', _('Export register as OFX')),
+            ('qif', _('Export register as QIF')))
+        for format, label in items:
+            menu_item = PaletteMenuItem(text_label=label)
+            menu_item.connect('activate', self.__export_register_cb, format)
+            menu_box.append_item(menu_item)
 
         menu_box.show_all()
         return export_data
@@ -292,9 +347,9 @@ class Finance(activity.Activity):
         helpitem.add_section(_('Register'), icon='view-list')
         helpitem.add_paragraph(registerscreen.REGISTER_HELP)
         helpitem.add_section(_('Budget'), icon='budget')
-        helpitem.add_paragraph(budgetscreen.BUDGET_HELP)
+        helpitem.add_paragraph(helptext.BUDGET_HELP)
         helpitem.add_section(_('Chart'), icon='chart')
-        helpitem.add_paragraph(chartscreen.CHART_HELP)
+        helpitem.add_paragraph(helptext.CHART_HELP)
         return helpitem
 
     def build_header(self):
@@ -387,13 +442,13 @@ class Finance(activity.Activity):
                 if child in (self.header_separator_visible,
                              self.export_image):
                     child.hide()
-            elif self._active_panel == self.budget:
+            elif self._active_panel == self._budget:
                 if child in (self.newcreditbtn, self.newdebitbtn,
                              self.eraseitembtn, self.undoactionbtn,
                              self.redoactionbtn, self.header_separator_visible,
                              self.export_image):
                     child.hide()
-            elif self._active_panel == self.chart:
+            elif self._active_panel == self._chart:
                 # Use NOT here
                 if child not in (self.newcreditbtn, self.newdebitbtn,
                                  self.header_separator_visible,
@@ -422,24 +477,52 @@ class Finance(activity.Activity):
         self.screenbox.pack_start(widget, True, True, 0)
         widget.show_all()
         self._active_panel = widget
-        self.build_screen()
+        self.invalidate(self.DIRTY_PANEL)
 
     def build_screen(self):
-        self.build_visible_transactions()
+        self.invalidate(self.DIRTY_ALL)
+
+    def invalidate(self, parts):
+        """Mark parts of the screen stale.
 
-        if hasattr(self._active_panel, 'build'):
+        They are rebuilt together from an idle callback, so a burst of
+        changes costs a single pass over the ledger.
+        """
+        self._dirty |= parts
+        if self._rebuild_id is None:
+            # Run before the next redraw, so stale data is never shown.
+            self._rebuild_id = GLib.idle_add(self.__rebuild_cb,
+                                             priority=GLib.PRIORITY_HIGH_IDLE)
+
+    def __rebuild_cb(self):
+        self._rebuild_id = None
+        self.rebuild()
+        return False
+
+    def rebuild(self):
+        """Rebuild the stale parts of the screen right away."""
+        dirty = self._dirty
+        self._dirty = 0
+
+        if dirty & self.DIRTY_VISIBLE:
+            self.build_visible_transactions()
+
+        if dirty & self.DIRTY_PANEL and hasattr(self._active_panel, 'build'):
             self._active_panel.build()
 
-        self.update_header()
-        self.update_summary()
-        self.update_toolbar()
+        if dirty & self.DIRTY_HEADER:
+            self.update_header()
+            self.update_toolbar()
+
+        if dirty & self.DIRTY_SUMMARY:
+            self.update_summary()
 
     def __empty_panel_btn_cb(self, button):
         self._set_internal_panel(self.register)
         self.register.new_credit()
 
     def __newcredit_cb(self, widget):
-        if self._active_panel == self.chart:
+        if self._active_panel == self._chart:
             # in the case of chart, select the graphic
             self.chart.set_mode(self.chart.CHART_CREDIT)
             return
@@ -450,7 +533,7 @@ class Finance(activity.Activity):
         self.register.new_credit()
 
     def __newdebit_cb(self, widget):
-        if self._active_panel == self.chart:
+        if self._active_panel == self._chart:
             # in the case of chart, select the graphic
             self.chart.set_mode(self.chart.CHART_DEBIT)
             return
@@ -462,15 +545,19 @@ class Finance(activity.Activity):
 
     def __undoaction_cb(self, widget):
         self.undo_transaction()
-        self.build_screen()
+        self.build_undo_buttons()
+        self.invalidate(
+            self.DIRTY_VISIBLE | self.DIRTY_SUMMARY | self.DIRTY_PANEL)
 
     def __redoaction_cb(self, widget):
         self.redo_transaction()
-        self.build_screen()
+        self.build_undo_buttons()
+        self.invalidate(
+            self.DIRTY_VISIBLE | self.DIRTY_SUMMARY | self.DIRTY_PANEL)
 
     def __eraseitem_cb(self, widget):
+        # The register removes the row itself.
         self.register.erase_item()
-        self.build_screen()
 
     def update_header(self):
         if self.period == DAY:
@@ -496,31 +583,10 @@ class Finance(activity.Activity):
             "<span size='xx-large' color='white'><b>" + text + "</b></span>")
 
     def update_summary(self):
-        # Calculate starting balance.
-        start = 0.0
-        for t in self.data['transactions']:
-            d = t['date']
-            if d < self.period_start.toordinal():
-                if t['type'] == 'credit':
-                    start += t['amount']
-                else:
-                    start -= t['amount']
-
-        # Calculate totals for this period.
-        credit_count = 0
-        credit_total = 0.0
-        debit_count = 0
-        debit_total = 0.0
-        total = start
-        for t in self.visible_transactions:
-            if t['type'] == 'credit':
-                credit_count += 1
-                credit_total += t['amount']
-                total += t['amount']
-            else:
-                debit_count += 1
-                debit_total += t['amount']
-                total -= t['amount']
+        # Calculate starting balance and totals for this period.
+        start, credit_total, credit_count, debit_total, debit_count = \
+            self.ledger.summary(self.period, self.period_start)
+        total = start + credit_total - debit_total
 
         # Update Balance.
         if total >= 0.0:
@@ -529,7 +595,7 @@ class Finance(activity.Activity):
             balancecolor = colors.DEBIT_COLOR
         balance = \
             "<span size='xx-large' foreground='white'><b>%s %s</b></span>" % \
-            (_('Balance: '), locale.currency(total))
+            (_('Balance: '), format_currency(total))
         self.balancelabel.set_markup(balance)
 
         self.balance_evbox.modify_bg(
@@ -540,18 +606,18 @@ class Finance(activity.Activity):
             _('Starting Balance:'))
         self.startamountlabel.set_markup(
             "<span foreground='white'><b>%s</b></span>" %
-            locale.currency(start))
+            format_currency(start))
 
         self.creditslabel.set_markup(
             "<span foreground='white'><b>%s</b></span>" %
             (_('%(credit_total)s in %(credit_count)d credits') %
-             {'credit_total': locale.currency(credit_total),
+             {'credit_total': format_currency(credit_total),
               'credit_count': credit_count}))
 
         self.debitslabel.set_markup(
             "<span foreground='white'><b>%s</b></span>" %
             (_('%(debit_total)s in %(debit_count)d debits') %
-             {'debit_total': locale.currency(debit_total),
+             {'debit_total': format_currency(debit_total),
               'debit_count': debit_count}))
 
     def update_toolbar(self):
@@ -587,56 +653,13 @@ class Finance(activity.Activity):
 
     # Update the label self.period to reflect the period.
     def get_this_period(self):
-        today = datetime.date.today()
-
-        if self.period == DAY:
-            return today
-
-        elif self.period == WEEK:
-            while today.weekday() != 0:
-                today -= datetime.timedelta(days=1)
-            return today
-
-        elif self.period == MONTH:
-            return datetime.date(today.year, today.month, 1)
-
-        elif self.period == YEAR:
-            return datetime.date(today.year, 1, 1)
-
-        elif self.period == FOREVER:
-            return datetime.date(1900, 1, 1)
+        return ledger.get_this_period(self.period)
 
     def get_next_period(self, start):
-        if self.period == DAY:
-            return start + datetime.timedelta(days=1)
-
-        elif self.period == WEEK:
-            return start + datetime.timedelta(days=7)
-
-        elif self.period == MONTH:
-            if start.month == 12:
-                return datetime.date(start.year + 1, 1, 1)
-            else:
-                return datetime.date(start.year, start.month + 1, 1)
-
-        elif self.period == YEAR:
-            return datetime.date(start.year + 1, 1, 1)
+        return ledger.get_next_period(self.period, start)
 
     def get_prev_period(self, start):
-        if self.period == DAY:
-            return start - datetime.timedelta(days=1)
-
-        elif self.period == WEEK:
-            return start - datetime.timedelta(days=7)
-
-        elif self.period == MONTH:
-            if start.month == 1:
-                return datetime.date(start.year - 1, 12, 1)
-            else:
-                return datetime.date(start.year, start.month - 1, 1)
-
-        elif self.period == YEAR:
-            return datetime.date(start.year - 1, 1, 1)
+        return ledger.get_prev_period(self.period, start)
 
     def thisperiod_cb(self, widget):
         if self.period != FOREVER:
@@ -655,364 +678,323 @@ class Finance(activity.Activity):
 
     def __period_changed_cb(self, widget, value):
         self.period = int(value)
-        self.update_toolbar()
 
         # Jump to 'this period'.
         self.period_start = self.get_this_period()
         self.build_screen()
 
+    def get_view_key(self):
+        """Return what the screens are built from: the period window
+        and the ledger version. Screens skip rebuilding while it holds.
+        """
+        return (self.period, self.period_start, self.ledger.version)
+
     def build_visible_transactions(self):
         self.build_undo_buttons()
 
-        if self.period == FOREVER:
-            self.visible_transactions = self.data['transactions']
-
-        else:
-            period_start_ord = self.period_start.toordinal()
-            period_end_ord = self.get_next_period(
-                self.period_start).toordinal()
-
-            self.visible_transactions = []
-            for t in self.data['transactions']:
-                d = t['date']
-                if d >= period_start_ord and d < period_end_ord:
-                    self.visible_transactions.append(t)
+        key = self.get_view_key()
+        if key == self._visible_key:
+            return
+        self._visible_key = key
 
-        self.visible_transactions.sort(key=lambda a: a['date'])
+        self.visible_ids = self.ledger.visible_ids(self.period,
+                                                   self.period_start)
 
-    def build_transaction_map(self):
-        self.transaction_map = {}
-        for t in self.data['transactions']:
-            self.transaction_map[t['id']] = t
+    def set_ledger(self, new_ledger):
+        self.ledger = new_ledger
+        # The ledger store is itself a mapping from id to transaction.
+        self.transaction_map = new_ledger.transactions
 
     def create_transaction(self, name='', type='debit', amount=0,
                            category='', date=datetime.date.today()):
-        id = self.data['next_id']
-        self.data['next_id'] += 1
-
-        t = {
-            'id': id,
+        return self.create_transactions([{
             'name': name,
             'type': type,
             'amount': amount,
-            'date': date.toordinal(),
+            'date': date,
             'category': category
-        }
-        self.data['transactions'].append(t)
-        self.transaction_map[id] = t
-
-        self.undo_id_map.append(id)
-        self.undo_transaction_map.append('Erase')
-        self.redo_transaction_map = []
-        self.redo_id_map = []
-
-        self.build_visible_transactions()
+        }])[0]
 
-        return id
+    def create_transactions(self, records):
+        ids = self.ledger.create_transactions(records)
+        self.build_undo_buttons()
+        self.invalidate(self.DIRTY_VISIBLE | self.DIRTY_SUMMARY)
+        return ids
 
     def destroy_transaction(self, id):
-        t = self.transaction_map[id]
-        self.data['transactions'].remove(t)
-        del self.transaction_map[id]
-
-    def undo_redo_action(self, id, t, isin=False):
-        # if we're updating the transaction
-        if t == 'Erase':
-            self.destroy_transaction(id)
-        elif isin:
-            for i in range(len(self.data['transactions'])):
-                if id == self.data['transactions'][i]['id']:
-                    self.data['transactions'][i] = t
-                    break
-        else:
-            # Have to insert it back into the right position
-            flag = 1
-            for i in range(len(self.data['transactions'])):
-                if id < self.data['transactions'][i]['id']:
-                    self.data['transactions'].insert(i, t)
-                    flag = 0
-                    break
-            if flag:
-                self.data['transactions'].append(t)
+        self.ledger.destroy_transaction(id)
 
     def undo_transaction(self):
-        if len(self.undo_transaction_map) == 0:
-            return False;
-
-        id = self.undo_id_map.pop()
-        t = self.undo_transaction_map.pop()
-
-        self.redo_id_map.append(id)
-        isin = False
-        if id in self.transaction_map.keys():
-            self.redo_transaction_map.append(copy.deepcopy(self.transaction_map[id]))
-            isin = True
-        else:
-            self.redo_transaction_map.append('Erase')
-
-        copy_t = copy.deepcopy(t)
-        self.undo_redo_action(id, copy_t, isin)
-
-        if t != 'Erase':
-            self.transaction_map[id] = copy_t
-        return True
+        return self.ledger.undo()
 
     def redo_transaction(self):
-        if len(self.redo_transaction_map) == 0:
-            return False
-
-        id = self.redo_id_map.pop()
-        t = self.redo_transaction_map.pop()
-
-        self.undo_id_map.append(id)
-        isin = False
-        if id in self.transaction_map.keys():
-            self.undo_transaction_map.append(copy.deepcopy(self.transaction_map[id]))
-            isin = True
-        else:
-            self.undo_transaction_map.append('Erase')
-
-        self.undo_redo_action(id, t, isin)
-
-        if t != 'Erase':
-            self.transaction_map[id] = copy.deepcopy(t)
-        return True
+        return self.ledger.redo()
 
     def build_undo_buttons(self):
-        if len(self.undo_transaction_map) == 0:
-            self.undoactionbtn.set_sensitive(False)
-        else:
-            self.undoactionbtn.set_sensitive(True)
-        if len(self.redo_transaction_map) == 0:
-            self.redoactionbtn.set_sensitive(False)
-        else:
-            self.redoactionbtn.set_sensitive(True)
-
-    def build_names(self):
-        self.transaction_names = {}
-        self.category_names = {}
-        for t in self.data['transactions']:
-            self.transaction_names[t['name']] = 1
-            self.category_names[t['category']] = 1
+        self.undoactionbtn.set_sensitive(self.ledger.undo_log.can_undo())
+        self.redoactionbtn.set_sensitive(self.ledger.undo_log.can_redo())
 
     def create_test_data(self):
+        records = []
+
+        def add(name, type='debit', amount=0, category='', date=None):
+            records.append({'name': name, 'type': type, 'amount': amount,
+                            'category': category, 'date': date})
+
         cur_date = datetime.date.today()
         cur_date = datetime.date(cur_date.year, cur_date.month, 1)
-        self.create_transaction('Initial Balance', type='credit', amount=632,
-                                category='Initial Balance', date=cur_date)
+        add('Initial Balance', type='credit', amount=632,
+            category='Initial Balance', date=cur_date)
 
         cur_date += datetime.timedelta(days=1)
-        self.create_transaction('Fix Car', amount=75.84,
-                                category='Transportation', date=cur_date)
+        add('Fix Car', amount=75.84,
+            category='Transportation', date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Adopt Cat', amount=100, category='Pets',
-                                date=cur_date)
-        self.create_transaction('New Coat', amount=25.53, category='Clothing',
-                                date=cur_date)
+        add('Adopt Cat', amount=100, category='Pets',
+            date=cur_date)
+        add('New Coat', amount=25.53, category='Clothing',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Pay Rent', amount=500, category='Housing',
-                                date=cur_date)
+        add('Pay Rent', amount=500, category='Housing',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=1)
-        self.create_transaction('Funky Cafe', amount=5.20, category='Food',
-                                date=cur_date)
-        self.create_transaction('Groceries', amount=50.92, category='Food',
-                                date=cur_date)
-        self.create_transaction('Cat Food', amount=5.40, category='Pets',
-                                date=cur_date)
+        add('Funky Cafe', amount=5.20, category='Food',
+            date=cur_date)
+        add('Groceries', amount=50.92, category='Food',
+            date=cur_date)
+        add('Cat Food', amount=5.40, category='Pets',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=4)
-        self.create_transaction('Paycheck', type='credit', amount=700,
-                                category='Paycheck', date=cur_date)
-        self.create_transaction('Gas', amount=21.20, category='Transportation',
-                                date=cur_date)
+        add('Paycheck', type='credit', amount=700,
+            category='Paycheck', date=cur_date)
+        add('Gas', amount=21.20, category='Transportation',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Cat Toys', amount=10.95, category='Pets',
-                                date=cur_date)
-        self.create_transaction('Gift for Sister', amount=23.20,
-                                category='Gifts', date=cur_date)
+        add('Cat Toys', amount=10.95, category='Pets',
+            date=cur_date)
+        add('Gift for Sister', amount=23.20,
+            category='Gifts', date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Pay Rent', amount=500, category='Housing',
-                                date=cur_date)
+        add('Pay Rent', amount=500, category='Housing',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=1)
-        self.create_transaction('Funky Cafe', amount=5.20, category='Food',
-                                date=cur_date)
-        self.create_transaction('Groceries', amount=50.92, category='Food',
-                                date=cur_date)
-        self.create_transaction('Cat Food', amount=5.40, category='Pets',
-                                date=cur_date)
+        add('Funky Cafe', amount=5.20, category='Food',
+            date=cur_date)
+        add('Groceries', amount=50.92, category='Food',
+            date=cur_date)
+        add('Cat Food', amount=5.40, category='Pets',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=4)
-        self.create_transaction('Paycheck', type='credit', amount=700,
-                                category='Paycheck', date=cur_date)
-        self.create_transaction('Gas', amount=21.20, category='Transportation',
-                                date=cur_date)
+        add('Paycheck', type='credit', amount=700,
+            category='Paycheck', date=cur_date)
+        add('Gas', amount=21.20, category='Transportation',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Cat Toys', amount=10.95, category='Pets',
-                                date=cur_date)
-        self.create_transaction('Gift for Sister', amount=23.20,
-                                category='Gifts', date=cur_date)
+        add('Cat Toys', amount=10.95, category='Pets',
+            date=cur_date)
+        add('Gift for Sister', amount=23.20,
+            category='Gifts', date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Pay Rent', amount=500, category='Housing',
-                                date=cur_date)
+        add('Pay Rent', amount=500, category='Housing',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=1)
-        self.create_transaction('Funky Cafe', amount=5.20, category='Food',
-                                date=cur_date)
-        self.create_transaction('Groceries', amount=50.92, category='Food',
-                                date=cur_date)
-        self.create_transaction('Cat Food', amount=5.40, category='Pets',
-                                date=cur_date)
+        add('Funky Cafe', amount=5.20, category='Food',
+            date=cur_date)
+        add('Groceries', amount=50.92, category='Food',
+            date=cur_date)
+        add('Cat Food', amount=5.40, category='Pets',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=4)
-        self.create_transaction('Paycheck', type='credit', amount=700,
-                                category='Paycheck', date=cur_date)
-        self.create_transaction('Gas', amount=21.20, category='Transportation',
-                                date=cur_date)
+        add('Paycheck', type='credit', amount=700,
+            category='Paycheck', date=cur_date)
+        add('Gas', amount=21.20, category='Transportation',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Cat Toys', amount=10.95, category='Pets',
-                                date=cur_date)
-        self.create_transaction('Gift for Sister', amount=23.20,
-                                category='Gifts', date=cur_date)
+        add('Cat Toys', amount=10.95, category='Pets',
+            date=cur_date)
+        add('Gift for Sister', amount=23.20,
+            category='Gifts', date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Pay Rent', amount=500, category='Housing',
-                                date=cur_date)
+        add('Pay Rent', amount=500, category='Housing',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=1)
-        self.create_transaction('Funky Cafe', amount=5.20, category='Food',
-                                date=cur_date)
-        self.create_transaction('Groceries', amount=50.92, category='Food',
-                                date=cur_date)
-        self.create_transaction('Cat Food', amount=5.40, category='Pets',
-                                date=cur_date)
+        add('Funky Cafe', amount=5.20, category='Food',
+            date=cur_date)
+        add('Groceries', amount=50.92, category='Food',
+            date=cur_date)
+        add('Cat Food', amount=5.40, category='Pets',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=4)
-        self.create_transaction('Paycheck', type='credit', amount=700,
-                                category='Paycheck', date=cur_date)
-        self.create_transaction('Gas', amount=21.20, category='Transportation',
-                                date=cur_date)
+        add('Paycheck', type='credit', amount=700,
+            category='Paycheck', date=cur_date)
+        add('Gas', amount=21.20, category='Transportation',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Cat Toys', amount=10.95, category='Pets',
-                                date=cur_date)
-        self.create_transaction('Gift for Sister', amount=23.20,
-                                category='Gifts', date=cur_date)
+        add('Cat Toys', amount=10.95, category='Pets',
+            date=cur_date)
+        add('Gift for Sister', amount=23.20,
+            category='Gifts', date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Pay Rent', amount=500, category='Housing',
-                                date=cur_date)
+        add('Pay Rent', amount=500, category='Housing',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=1)
-        self.create_transaction('Funky Cafe', amount=5.20, category='Food',
-                                date=cur_date)
-        self.create_transaction('Groceries', amount=50.92, category='Food',
-                                date=cur_date)
-        self.create_transaction('Cat Food', amount=5.40, category='Pets',
-                                date=cur_date)
+        add('Funky Cafe', amount=5.20, category='Food',
+            date=cur_date)
+        add('Groceries', amount=50.92, category='Food',
+            date=cur_date)
+        add('Cat Food', amount=5.40, category='Pets',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=4)
-        self.create_transaction('Paycheck', type='credit', amount=700,
-                                category='Paycheck', date=cur_date)
-        self.create_transaction('Gas', amount=21.20, category='Transportation',
-                                date=cur_date)
+        add('Paycheck', type='credit', amount=700,
+            category='Paycheck', date=cur_date)
+        add('Gas', amount=21.20, category='Transportation',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Cat Toys', amount=10.95, category='Pets',
-                                date=cur_date)
-        self.create_transaction('Gift for Sister', amount=23.20,
-                                category='Gifts', date=cur_date)
+        add('Cat Toys', amount=10.95, category='Pets',
+            date=cur_date)
+        add('Gift for Sister', amount=23.20,
+            category='Gifts', date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Pay Rent', amount=500, category='Housing',
-                                date=cur_date)
+        add('Pay Rent', amount=500, category='Housing',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=1)
-        self.create_transaction('Funky Cafe', amount=5.20, category='Food',
-                                date=cur_date)
-        self.create_transaction('Groceries', amount=50.92, category='Food',
-                                date=cur_date)
-        self.create_transaction('Cat Food', amount=5.40, category='Pets',
-                                date=cur_date)
+        add('Funky Cafe', amount=5.20, category='Food',
+            date=cur_date)
+        add('Groceries', amount=50.92, category='Food',
+            date=cur_date)
+        add('Cat Food', amount=5.40, category='Pets',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=4)
-        self.create_transaction('Paycheck', type='credit', amount=700,
-                                category='Paycheck', date=cur_date)
-        self.create_transaction('Gas', amount=21.20, category='Transportation',
-                                date=cur_date)
+        add('Paycheck', type='credit', amount=700,
+            category='Paycheck', date=cur_date)
+        add('Gas', amount=21.20, category='Transportation',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Cat Toys', amount=10.95, category='Pets',
-                                date=cur_date)
-        self.create_transaction('Gift for Sister', amount=23.20,
-                                category='Gifts', date=cur_date)
+        add('Cat Toys', amount=10.95, category='Pets',
+            date=cur_date)
+        add('Gift for Sister', amount=23.20,
+            category='Gifts', date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Pay Rent', amount=500, category='Housing',
-                                date=cur_date)
+        add('Pay Rent', amount=500, category='Housing',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=1)
-        self.create_transaction('Funky Cafe', amount=5.20, category='Food',
-                                date=cur_date)
-        self.create_transaction('Groceries', amount=50.92, category='Food',
-                                date=cur_date)
-        self.create_transaction('Cat Food', amount=5.40, category='Pets',
-                                date=cur_date)
+        add('Funky Cafe', amount=5.20, category='Food',
+            date=cur_date)
+        add('Groceries', amount=50.92, category='Food',
+            date=cur_date)
+        add('Cat Food', amount=5.40, category='Pets',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=4)
-        self.create_transaction('Paycheck', type='credit', amount=700,
-                                category='Paycheck', date=cur_date)
-        self.create_transaction('Gas', amount=21.20, category='Transportation',
-                                date=cur_date)
+        add('Paycheck', type='credit', amount=700,
+            category='Paycheck', date=cur_date)
+        add('Gas', amount=21.20, category='Transportation',
+            date=cur_date)
 
         cur_date += datetime.timedelta(days=2)
-        self.create_transaction('Cat Toys', amount=10.95, category='Pets',
-                                date=cur_date)
-        self.create_transaction('Gift for Sister', amount=23.20,
-                                category='Gifts', date=cur_date)
+        add('Cat Toys', amount=10.95, category='Pets',
+            date=cur_date)
+        add('Gift for Sister', amount=23.20,
+            category='Gifts', date=cur_date)
 
-        self.build_transaction_map()
-        self.build_names()
+        self.create_transactions(records)
 
     def read_file(self, file_path):
-        if self.metadata['mime_type'] != 'text/plain':
+        # Older versions saved JSON as text/plain.
+        if self.metadata['mime_type'] not in ('text/plain',
+                                              journal.MIME_TYPE):
             return
 
-        fd = open(file_path, 'r')
-        try:
-            text = fd.read()
-            self.data = json.loads(text)
-        finally:
-            fd.close()
+        self._oplog = journal.OpLog.open(file_path, self._get_log_path())
+        self.set_ledger(self._oplog.book)
+        _trace('ledger loaded')
 
-        if self.data['transactions']:
+        if len(self.ledger):
             self._set_internal_panel(self.register)
         self.show_header_controls()
 
-        self.build_transaction_map()
-        self.build_names()
-        self.build_screen()
+        self.invalidate(self.DIRTY_ALL)
 
     def write_file(self, file_path):
-        if not self.metadata['mime_type']:
-            self.metadata['mime_type'] = 'text/plain'
+        self.metadata['mime_type'] = journal.MIME_TYPE
+
+        # The working log is brought up to date and handed over to the
+        # Journal as a single snapshot, so it opens mapped. That
+        # happens in a worker thread, from a copy of the ledger, and
+        # the main loop keeps running until it is done. Edits made
+        # meanwhile are left in the log for the next save.
+        if self._oplog is None or self._oplog.book is not self.ledger:
+            self._oplog = journal.OpLog(self.ledger, self._get_log_path())
+        job = self._oplog.start_save(file_path, self.__save_done)
+        if self._saving:
+            # Called again from the main loop below, by a close request
+            # for instance; start_save waited for the running save.
+            job.join()
+        else:
+            self._wait_for_save(job)
+        if job.error is not None:
+            raise job.error
 
-        fd = open(file_path, 'w')
+    def _wait_for_save(self, job):
+        job.join(0.05)
+        if not job.is_alive():
+            return
+        # The Journal reads the file once write_file returns.
+        self._saving = True
         try:
-            text = json.dumps(self.data)
-            fd.write(text)
+            while job.is_alive():
+                Gtk.main_iteration_do(False)
+                job.join(0.01)
         finally:
-            fd.close()
+            self._saving = False
+
+    def __save_done(self, error):
+        # Called from the save thread.
+        GLib.idle_add(self.__save_done_cb, error)
+
+    def __save_done_cb(self, error):
+        if error is not None:
+            log.error('Saving the ledger failed: %s', error)
+        else:
+            log.debug('Ledger saved')
+        return False
+
+    def _get_log_path(self):
+        return os.path.join(activity.get_activity_root(), 'instance',
+                            'ledger-%s' % self.get_id())
 
     def __save_image_cb(self, widget):
+        import tempfile
+        import dbus
+        from sugar3.datastore import datastore
+
         image_file = tempfile.NamedTemporaryFile(mode='w+b', suffix='.png')
         journal_entry = datastore.create()
         journal_entry.metadata['title'] = self.chart.title
@@ -1066,7 +1048,9 @@ class Finance(activity.Activity):
         type_movement = 'debit' or 'credit'
         period
             DAY = 0
+            WEEK = 1
             MONTH = 2
+            YEAR = 3
         """
         logging.debug('export data %s %s', type_movement, period)
 
@@ -1087,14 +1071,15 @@ class Finance(activity.Activity):
 
         if period == DAY:
             when = 'day'
+        elif period == WEEK:
+            when = 'week'
         elif period == MONTH:
             when = 'month'
+        elif period == YEAR:
+            when = 'year'
         else:
-            logging.debug('ERROR period should be DAY or MONTH')
+            logging.debug('ERROR period should be DAY, WEEK, MONTH or YEAR')
 
-        title = _('%(what_filter)s by %(when)s') % {
-            'what_filter': what_filter, 'when': when}
-        chart_params['title'] = title
         chart_params['x_label'] = ''
         chart_params['y_label'] = ''
         chart_params['current_chart.type'] = 1
@@ -1107,33 +1092,150 @@ class Finance(activity.Activity):
             ['hello', 200.0],
             ['mrch', 100.0]],
         """
-        transactions = self.data['transactions']
-
-        groups = {}
-        for transaction in transactions:
-            if transaction['type'] == type_movement:
-                date = transaction['date']
-                if period == DAY:
-                    group = date
-                elif period == MONTH:
-                    d = datetime.date.fromordinal(date)
-                    group = datetime.date(d.year, d.month, 1).toordinal()
-                if group in list(groups.keys()):
-                    groups[group] = groups[group] + transaction['amount']
-                else:
-                    groups[group] = transaction['amount']
-
-        data = []
-        for group in sorted(groups.keys()):
-            if period == DAY:
-                label = datetime.date.fromordinal(group).isoformat()
-            elif period == MONTH:
-                d = datetime.date.fromordinal(group)
-                label = '%s-%s' % (d.year, d.month)
-
-            data.append([label, groups[group]])
-
-        chart_params['chart_data'] = data
+        if self._export_by_category.get_active():
+            charts = []
+            series = self.ledger.export_series(type_movement, period)
+            for category in sorted(series):
+                title = _('%(what_filter)s of %(category)s by %(when)s') % {
+                    'what_filter': what_filter, 'when': when,
+                    'category': category or _('Uncategorized')}
+                charts.append((title, series[category]))
+        else:
+            title = _('%(what_filter)s by %(when)s') % {
+                'what_filter': what_filter, 'when': when}
+            charts = [(title, self.ledger.export_groups(type_movement,
+                                                        period))]
+
+        for title, chart_data in charts:
+            chart_params['title'] = title
+            chart_params['chart_data'] = chart_data
+            object_id = self._write_chart(title, chart_params)
+
+        if charts:
+            self._show_journal_alert(
+                _('Exported data'), _('Open in the Journal'), object_id)
+
+    def __import_cb(self, button):
+        """Pick a CSV, OFX or QIF statement, or another Finance journal,
+        in the Journal and import it from the idle loop, a chunk of rows
+        per call."""
+        from sugar3.graphics.objectchooser import ObjectChooser
+        import importer
+
+        if self._importer is not None:
+            return
+        chooser = ObjectChooser(parent=self)
+        try:
+            if chooser.run() != Gtk.ResponseType.ACCEPT:
+                return
+            jobject = chooser.get_selected_object()
+        finally:
+            chooser.destroy()
+        if jobject is None:
+            return
+
+        try:
+            self._importer = importer.Importer(self.ledger, jobject.file_path)
+        except importer.ERRORS as error:
+            jobject.destroy()
+            self._show_import_alert(_('Import failed'), str(error))
+            return
+        self._import_object = jobject
+        self._import_alert = self._show_import_alert(
+            _('Importing %s') % jobject.metadata.get('title', ''), '')
+        GLib.idle_add(self.__import_step_cb)
+
+    def __import_step_cb(self):
+        from importer import ERRORS
+
+        importer = self._importer
+        try:
+            more = importer.step()
+        except ERRORS as error:
+            importer.close()
+            self._finish_import(_('Import failed'), str(error))
+            return False
+
+        if more:
+            self._import_alert.props.msg = _('%d%% read') % int(
+                importer.progress * 100)
+            return True
+        if importer.commit_step():
+            self._import_alert.props.msg = _('%d%% added') % int(
+                importer.commit_progress * 100)
+            return True
+
+        ids = importer.ids
+        self._finish_import(
+            _('Import done'),
+            _('%(count)d transactions imported, %(errors)d rows skipped, '
+              '%(duplicates)d duplicates skipped, %(near)d possible '
+              'duplicates') %
+            {'count': len(ids), 'errors': len(importer.errors),
+             'duplicates': len(importer.duplicates),
+             'near': len(importer.near_matches)})
+        for line_num, message in importer.errors:
+            logging.debug('import line %d: %s', line_num, message)
+        for line_num, near_ids in importer.near_matches:
+            logging.debug('import line %d may duplicate %s', line_num,
+                          near_ids)
+        self.build_undo_buttons()
+        self.build_screen()
+        return False
+
+    def _finish_import(self, title, msg):
+        self._importer = None
+        self._import_object.destroy()
+        self._import_object = None
+        self.remove_alert(self._import_alert)
+        self._import_alert = None
+        self._show_import_alert(title, msg)
+
+    def _show_import_alert(self, title, msg):
+        alert = Alert()
+        alert.props.title = title
+        alert.props.msg = msg
+        ok_icon = Icon(icon_name='dialog-ok')
+        alert.add_button(Gtk.ResponseType.OK, _('Ok'), ok_icon)
+        ok_icon.show()
+        alert.connect('response', lambda a, r: self.remove_alert(a))
+        self.add_alert(alert)
+        alert.show()
+        return alert
+
+    def __export_register_cb(self, widget, format):
+        """Save the transactions of the period on screen to the Journal,
+        in one of exporter.FORMATS."""
+        import tempfile
+        from sugar3.datastore import datastore
+        import exporter
+
+        mime_type, suffix = exporter.FORMATS[format]
+        fd, file_path = tempfile.mkstemp(
+            suffix=suffix,
+            dir=os.path.join(activity.get_activity_root(), 'instance'))
+        os.close(fd)
+        exporter.export(self.ledger, file_path, format, self.period,
+                        self.period_start)
+
+        title = _('%(title)s register') % {
+            'title': self.metadata.get('title', _('Finance'))}
+        journal_entry = datastore.create()
+        journal_entry.metadata['title'] = title
+        journal_entry.metadata['mime_type'] = mime_type
+        journal_entry.file_path = file_path
+
+        logging.debug('Create %s register file', file_path)
+        datastore.write(journal_entry, transfer_ownership=True)
+        self._show_journal_alert(
+            _('Exported register'), _('Open in the Journal'),
+            journal_entry.object_id)
+
+    def _write_chart(self, title, chart_params):
+        """Save chart_params as a SimpleGraph entry in the Journal and
+        return its object id."""
+        import tempfile
+        from sugar3.datastore import datastore
 
         logging.debug('chart_data %s', chart_params)
 
@@ -1151,6 +1253,4 @@ class Finance(activity.Activity):
 
         logging.debug('Create %s data file', data_file.name)
         datastore.write(journal_entry)
-        self._show_journal_alert(
-            _('Exported data'), _('Open in the Journal'),
-            journal_entry.object_id)
+        return journal_entry.object_id
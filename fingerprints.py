@@ -0,0 +1,186 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import standard Python modules.
+import array
+import bisect
+import itertools
+import re
+
+from ledgerstore import CREDIT
+from undolog import CREATE, ERASE, EXTEND
+
+# Fields that are part of a fingerprint.
+_FIELDS = ('date', 'amount', 'type', 'name')
+
+_WORD = re.compile(r'\w+')
+
+# Transaction ids live in the low bits of the window keys, like in
+# dateindex.
+_ID_BITS = 32
+_ID_MASK = (1 << _ID_BITS) - 1
+
+
+def normalize_name(name):
+    """Return name lower cased, with only its words, so that 'ACME
+    Corp.' and 'acme  corp' match."""
+    return ' '.join(_WORD.findall(name.lower()))
+
+
+def fingerprint(t):
+    """Return the fingerprint of a transaction or record, whose date is
+    an ordinal."""
+    return (t['date'], round(t['amount'] * 100), t['type'] == 'credit',
+            normalize_name(t['name']))
+
+
+# Fingerprints of the transactions of a store, to spot duplicates.
+#
+# The number of transactions with each fingerprint is kept in a dict,
+# so an exact duplicate is found in constant time. For near matches,
+# the transactions of each (amount, type) are also kept in date order,
+# and a window of days around a date is two binary searches away.
+#
+# Like rollup.Rollup, the index is built on the first query and then
+# kept up to date from the store listener calls. Building it and adding
+# the transactions of an extend() read the store columns directly, and
+# normalize each distinct name once. build_step() builds it a chunk at
+# a time instead, for the idle loop; a change to the store before it is
+# done starts the build over.
+
+class FingerprintIndex:
+    def __init__(self, store):
+        self.store = store
+        self._counts = None
+        self._windows = None
+        # Slots not built yet, and how many, while building in steps.
+        self._unbuilt = None
+        self._left = 0
+        store.listeners.append(self.record)
+
+    def build_step(self, count=None):
+        """Add up to count more transactions, or all of them, to the
+        index, and return True once it is built."""
+        if self._unbuilt is None:
+            if self._counts is not None:
+                return True
+            self._counts = {}
+            self._windows = {}
+            slots = self.store.live_slots()
+            self._unbuilt = iter(slots)
+            self._left = len(slots)
+        if count is None or count > self._left:
+            count = self._left
+        self._add_slots(itertools.islice(self._unbuilt, count))
+        self._left -= count
+        if self._left:
+            return False
+        self._unbuilt = None
+        return True
+
+    def _add_slots(self, slots):
+        store = self.store
+        ids = store.ids
+        dates = store.dates
+        amounts = store.amounts
+        types = store.types
+        names = store.names
+        name_table = store.name_table
+        normalized = {}
+
+        counts = self._counts
+        added = {}
+        for slot in slots:
+            code = names[slot]
+            name = normalized.get(code)
+            if name is None:
+                name = normalized[code] = normalize_name(name_table[code])
+            date = dates[slot]
+            key = (date, round(amounts[slot] * 100), types[slot] == CREDIT,
+                   name)
+            counts[key] = counts.get(key, 0) + 1
+            added.setdefault(key[1:3], []).append(
+                (date << _ID_BITS) | ids[slot])
+
+        windows = self._windows
+        for amount, keys in added.items():
+            window = windows.get(amount)
+            if window is None:
+                windows[amount] = array.array('q', sorted(keys))
+            elif len(keys) < 16:
+                for key in keys:
+                    bisect.insort(window, key)
+            else:
+                # Sorting two sorted runs is a single merge.
+                keys.sort()
+                windows[amount] = array.array(
+                    'q', sorted(window + array.array('q', keys)))
+
+    def _add(self, id, t):
+        key = fingerprint(t)
+        self._counts[key] = self._counts.get(key, 0) + 1
+        window = self._windows.get(key[1:3])
+        if window is None:
+            window = self._windows[key[1:3]] = array.array('q')
+        bisect.insort(window, (key[0] << _ID_BITS) | id)
+
+    def _remove(self, id, t):
+        key = fingerprint(t)
+        count = self._counts[key] - 1
+        if count:
+            self._counts[key] = count
+        else:
+            del self._counts[key]
+        window = self._windows[key[1:3]]
+        i = bisect.bisect_left(window, (key[0] << _ID_BITS) | id)
+        del window[i]
+        if not window:
+            del self._windows[key[1:3]]
+
+    def record(self, kind, id, field, old, new):
+        """Store listener, see LedgerStore."""
+        if self._counts is None:
+            return
+        if self._unbuilt is not None:
+            self._counts = self._windows = self._unbuilt = None
+            return
+        if kind == EXTEND:
+            self._add_slots(self.store.slots(id))
+        elif kind == CREATE:
+            self._add(id, self.store.get_record(id))
+        elif kind == ERASE:
+            self._remove(id, old)
+        elif field in _FIELDS:
+            t = self.store.get_record(id)
+            self._add(id, t)
+            t[field] = old
+            self._remove(id, t)
+
+    def count(self, t):
+        """Return how many transactions have the fingerprint of t."""
+        self.build_step()
+        return self._counts.get(fingerprint(t), 0)
+
+    def near(self, t, days):
+        """Return the ids of the transactions of the same type and
+        amount as t, dated within days of it, in date order."""
+        self.build_step()
+        key = fingerprint(t)
+        window = self._windows.get(key[1:3])
+        if window is None:
+            return []
+        lo = bisect.bisect_left(window, (key[0] - days) << _ID_BITS)
+        hi = bisect.bisect_left(window, (key[0] + days + 1) << _ID_BITS)
+        return [k & _ID_MASK for k in window[lo:hi]]
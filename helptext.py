@@ -0,0 +1,28 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+# Help for the screens that are only loaded when first shown, so that
+# the help button does not have to load them.
+
+from gettext import gettext as _
+
+BUDGET_HELP = _(
+    'The Budget view allows you to set a monthly budget for each expense '
+    'category, and to keep track of your\nbudgets. To set a budget, type '
+    'the amount in the box to the right of the category.')
+
+CHART_HELP = _(
+    'The Chart view shows the proportion of your expenses that is in each '
+    'category.\nYou can categorize transactions in the Register view.')
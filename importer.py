@@ -0,0 +1,384 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reading bank statements in CSV, OFX and QIF files into a ledger.
+
+The file is parsed as a stream, a chunk of rows at a time, so that the
+activity can import from the idle loop and show progress. Nothing is
+added to the ledger until the whole file has been read, and then the
+rows go in a chunk at a time too, as a single undo step.
+"""
+
+# Import standard Python modules.
+import csv
+import datetime
+import functools
+import io
+import locale
+import os
+import re
+import struct
+from xml.sax.saxutils import unescape
+
+from fingerprints import fingerprint
+import journal
+from parse import evaluate
+
+# Rows parsed and validated, or added to the ledger, per step.
+CHUNK_SIZE = 1000
+
+# Transactions of the ledger added to its fingerprint index per step,
+# before the first rows are matched.
+INDEX_CHUNK_SIZE = 20000
+
+# Rows with the same amount and type as a transaction this many days
+# apart are reported as possible duplicates.
+NEAR_DAYS = 3
+
+# Date formats tried in order, after the locale's own.
+_DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', "%m/%d'%y", '%m/%d/%y', '%Y%m%d')
+
+# CSV column headings, lower cased, for each field.
+_CSV_COLUMNS = {
+    'date': ('date', 'posted', 'transaction date'),
+    'name': ('name', 'description', 'payee', 'memo'),
+    'category': ('category',),
+    'type': ('type',),
+    'amount': ('amount', 'value'),
+    'credit': ('credit', 'deposit'),
+    'debit': ('debit', 'withdrawal'),
+}
+
+_OFX_TAG = re.compile(r'<(/?)(\w+)>([^<]*)')
+
+# Raised while reading a file that is not a statement or a journal.
+ERRORS = (ValueError, csv.Error, struct.error, KeyError, OSError)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(text):
+    """Return the date written in text, or raise ValueError."""
+    text = text.strip()
+    # OFX dates may be followed by a time and a time zone.
+    if len(text) > 8 and text[:8].isdigit():
+        text = text[:8]
+    for format in (locale.nl_langinfo(locale.D_FMT),) + _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, format).date()
+        except ValueError:
+            pass
+    raise ValueError('Invalid date %r' % text)
+
+
+def parse_amount(text, conventions=None):
+    """Return the amount written in text with the rules of
+    parse.evaluate, after dropping any currency symbol, or raise
+    ValueError. conventions is locale.localeconv(), which is slow to
+    ask for on every row."""
+    if conventions is None:
+        conventions = locale.localeconv()
+    value = text.strip()
+    if conventions['currency_symbol']:
+        value = value.replace(conventions['currency_symbol'], '')
+    value = value.replace(' ', '')
+
+    # The plain numbers of locale.atof, without asking for the
+    # conventions again.
+    number = value
+    if conventions['mon_thousands_sep']:
+        number = number.replace(conventions['mon_thousands_sep'], '')
+    if conventions['thousands_sep']:
+        number = number.replace(conventions['thousands_sep'], '')
+    if conventions['decimal_point'] != '.':
+        number = number.replace(conventions['decimal_point'], '.')
+    try:
+        return float(number)
+    except ValueError:
+        pass
+
+    amount = evaluate(value)
+    if amount is None:
+        raise ValueError('Invalid amount %r' % text)
+    return float(amount)
+
+
+def detect_format(fd):
+    """Return 'csv', 'ofx', 'qif' or 'journal' for a binary file, from
+    its start."""
+    if fd.peek(len(journal.MAGIC)).startswith(journal.MAGIC):
+        return 'journal'
+    start = fd.peek(256)[:256].lstrip().upper()
+    if start.startswith(b'{'):
+        return 'journal'
+    if start.startswith(b'!TYPE') or start.startswith(b'!ACCOUNT'):
+        return 'qif'
+    if b'OFX' in start or start.startswith(b'<?XML'):
+        return 'ofx'
+    return 'csv'
+
+
+def _csv_rows(text):
+    reader = csv.reader(text)
+    heading = [h.strip().lower() for h in next(reader, [])]
+    columns = {}
+    for field, names in _CSV_COLUMNS.items():
+        for i, h in enumerate(heading):
+            if h in names and field not in columns:
+                columns[field] = i
+    amounts = ('amount', 'credit', 'debit')
+    if 'date' not in columns or not any(f in columns for f in amounts):
+        raise ValueError('No date and amount columns in %r' % heading)
+
+    for row in reader:
+        if not any(row):
+            continue
+        raw = {}
+        for field, i in columns.items():
+            if i < len(row):
+                raw[field] = row[i]
+        yield reader.line_num, raw
+
+
+def _qif_rows(text):
+    raw = {}
+    start = 1
+    for line_num, line in enumerate(text, 1):
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('!'):
+            continue
+        code, value = line[0], line[1:]
+        if code == '^':
+            if raw:
+                yield start, raw
+            raw = {}
+            start = line_num + 1
+        elif code == 'D':
+            raw['date'] = value
+        elif code in 'TU' and 'amount' not in raw:
+            raw['amount'] = value
+        elif code == 'P':
+            raw['name'] = value
+        elif code == 'M' and 'name' not in raw:
+            raw['name'] = value
+        elif code == 'L':
+            raw['category'] = value
+    if raw:
+        yield start, raw
+
+
+def _ofx_rows(text):
+    # Works for both the SGML and XML flavours, as the fields of a
+    # transaction are each read up to the next tag.
+    fields = {'DTPOSTED': 'date', 'TRNAMT': 'amount', 'NAME': 'name',
+              'PAYEE': 'name', 'MEMO': 'memo'}
+    raw = None
+    start = None
+    for line_num, line in enumerate(text, 1):
+        for closing, tag, value in _OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if closing and raw is not None:
+                    if 'name' not in raw and 'memo' in raw:
+                        raw['name'] = raw['memo']
+                    raw.pop('memo', None)
+                    yield start, raw
+                    raw = None
+                elif not closing:
+                    raw = {}
+                    start = line_num
+            elif raw is not None and not closing and tag in fields:
+                raw.setdefault(fields[tag], unescape(value.strip()))
+
+
+def _journal_rows(file_path):
+    # Rows of another Finance journal are already valid records.
+    book = journal.read(file_path)
+    for row_num, t in enumerate(book.transactions, 1):
+        record = t.copy()
+        record['date'] = datetime.date.fromordinal(record['date'])
+        yield row_num, record
+
+
+_READERS = {'csv': _csv_rows, 'ofx': _ofx_rows, 'qif': _qif_rows}
+
+
+def validate(raw, conventions=None):
+    """Return the create_transaction record for a parsed row, or raise
+    ValueError."""
+    if conventions is None:
+        conventions = locale.localeconv()
+    if 'date' not in raw:
+        raise ValueError('Missing date')
+    date = parse_date(raw['date'])
+
+    type = raw.get('type', '').strip().lower()
+    if raw.get('amount', '').strip():
+        amount = parse_amount(raw['amount'], conventions)
+    elif raw.get('credit', '').strip():
+        amount = abs(parse_amount(raw['credit'], conventions))
+        type = 'credit'
+    elif raw.get('debit', '').strip():
+        amount = -abs(parse_amount(raw['debit'], conventions))
+        type = 'debit'
+    else:
+        raise ValueError('Missing amount')
+    if type not in ('credit', 'debit'):
+        type = 'credit' if amount > 0 else 'debit'
+
+    return {
+        'name': raw.get('name', '').strip(),
+        'type': type,
+        'amount': abs(amount),
+        'date': date,
+        'category': raw.get('category', '').strip()
+    }
+
+
+# One import of a statement file, or merge of another journal, into a
+# ledger.
+#
+# step() reads and validates the next chunk of rows, and returns False
+# once the file is done; rows that do not validate are kept in errors
+# as (line number, message). Rows matching a transaction of the ledger
+# exactly, see fingerprints, are kept in duplicates and left out when
+# skip_duplicates is set. Rows with the same amount as transactions a
+# few days apart are only reported, in near_matches as (line number,
+# ids). commit_step() then adds the good rows a chunk at a time, their
+# ids going to ids, or commit() all at once.
+
+class Importer:
+    def __init__(self, book, file_path, format=None, chunk_size=CHUNK_SIZE,
+                 skip_duplicates=True, near_days=NEAR_DAYS):
+        self.book = book
+        self.chunk_size = chunk_size
+        self.skip_duplicates = skip_duplicates
+        self.near_days = near_days
+        self.records = []
+        self.ids = []
+        self.errors = []
+        self.duplicates = []
+        self.near_matches = []
+        self._conventions = locale.localeconv()
+        # How many rows of each fingerprint were matched so far, so
+        # that a statement holding the same row twice only matches two
+        # transactions of the ledger.
+        self._matched = {}
+        self._committing = False
+
+        self._size = os.path.getsize(file_path)
+        self._raw = open(file_path, 'rb')
+        try:
+            if format is None:
+                format = detect_format(self._raw)
+            self.format = format
+            if format == 'journal':
+                self._rows = _journal_rows(file_path)
+            else:
+                text = io.TextIOWrapper(self._raw, encoding='utf-8',
+                                        errors='replace', newline='')
+                self._rows = _READERS[format](text)
+        except Exception:
+            self._raw.close()
+            raise
+
+    @property
+    def progress(self):
+        """Fraction of the file read so far."""
+        if self._raw.closed or not self._size:
+            return 1.0
+        return min(self._raw.tell() / self._size, 1.0)
+
+    @property
+    def commit_progress(self):
+        """Fraction of the rows read added to the ledger so far."""
+        if not self.records:
+            return 1.0
+        return len(self.ids) / len(self.records)
+
+    def step(self):
+        if not self.book.fingerprints.build_step(INDEX_CHUNK_SIZE):
+            return True
+        for i in range(self.chunk_size):
+            try:
+                line_num, raw = next(self._rows)
+            except StopIteration:
+                self.close()
+                return False
+            if self.format == 'journal':
+                record = raw
+            else:
+                try:
+                    record = validate(raw, self._conventions)
+                except ValueError as error:
+                    self.errors.append((line_num, str(error)))
+                    continue
+
+            t = dict(record, date=record['date'].toordinal())
+            if self._is_duplicate(t):
+                self.duplicates.append(line_num)
+                if self.skip_duplicates:
+                    continue
+            elif self.near_days:
+                ids = self.book.fingerprints.near(t, self.near_days)
+                if ids:
+                    self.near_matches.append((line_num, ids))
+            self.records.append(record)
+        return True
+
+    def _is_duplicate(self, t):
+        key = fingerprint(t)
+        matched = self._matched.get(key, 0)
+        if matched < self.book.fingerprints.count(t):
+            self._matched[key] = matched + 1
+            return True
+        return False
+
+    def close(self):
+        self._raw.close()
+
+    def commit_step(self):
+        """Add the next chunk of rows to the ledger, and return False
+        once they are all in. The chunks make one undo step, which also
+        takes in any other edit made in between."""
+        self.close()
+        undo_log = self.book.undo_log
+        if not self._committing:
+            self._committing = True
+            undo_log.begin_group()
+        start = len(self.ids)
+        records = self.records[start:start + self.chunk_size]
+        if records:
+            self.ids.extend(self.book.create_transactions(records))
+        if len(self.ids) < len(self.records):
+            return True
+        self._committing = False
+        undo_log.end_group()
+        return False
+
+    def commit(self):
+        """Add the rows read to the ledger as one undo step and return
+        their ids."""
+        while self.commit_step():
+            pass
+        return self.ids
+
+
+def import_file(book, file_path, format=None):
+    """Import a whole file at once, returning the Importer."""
+    importer = Importer(book, file_path, format)
+    while importer.step():
+        pass
+    importer.commit()
+    return importer
@@ -0,0 +1,807 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reading and writing ledgers to Journal files.
+
+Ledgers are saved in a binary journal format, see OpLog. The JSON
+journals of earlier versions are still read, and upgraded the first
+time they are saved.
+"""
+
+# Import standard Python modules.
+import array
+import itertools
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import threading
+import zlib
+
+from ledger import Ledger
+from balanceindex import PrefixBalanceIndex
+from dateindex import SortedDateIndex
+from ledgerstore import LedgerStore, StringTable
+from undolog import CREATE, ERASE, EXTEND
+
+# Mime type of the binary journal format.
+MIME_TYPE = 'application/x-finance-journal'
+
+# The binary format starts with the magic and the format version, and
+# goes on with records of a kind, a payload length, the payload and the
+# CRC-32 of the payload.
+MAGIC = b'FINANCE\x00'
+VERSION = 3
+# The last field is the codec of the snapshot record in its low byte,
+# and the compression level in its high byte.
+_HEADER = struct.Struct('<8sHH')
+_RECORD = struct.Struct('<cI')
+_CRC = struct.Struct('<I')
+
+COLUMNS = b'C'
+OPERATION = b'O'
+
+# A snapshot payload starts with next_id, the number of rows and the
+# size of the budgets, followed by the name and category string tables,
+# holding only the strings in use, and the budgets as JSON, padded up to
+# a multiple of 8 bytes in the file. Then come the columns of the rows
+# in (date, id) order, as (name, format, extra items), widest items
+# first so that every column is aligned. The running totals hold the sum
+# before each row plus the grand total, sorted_ids and id_slots map ids
+# to rows.
+_SNAPSHOT_HEADER = struct.Struct('<qII')
+_COUNT = struct.Struct('<I')
+_COLUMN_LAYOUT = (
+    ('ids', 'q', 0),
+    ('amounts', 'd', 0),
+    ('credit_total', 'd', 1),
+    ('debit_total', 'd', 1),
+    ('credit_count', 'q', 1),
+    ('sorted_ids', 'q', 0),
+    ('dates', 'i', 0),
+    ('names', 'i', 0),
+    ('categories', 'i', 0),
+    ('id_slots', 'i', 0),
+    ('types', 'b', 0),
+)
+_ALIGNMENT = 8
+
+# Snapshot compression codecs, operation records are never compressed.
+CODECS = {'none': 0, 'zlib': 1, 'lzma': 2, 'bz2': 3}
+_DEFAULT_LEVELS = {'none': 0, 'zlib': 6, 'lzma': 6, 'bz2': 9}
+_LEVELS = {'none': range(1), 'zlib': range(10), 'lzma': range(10),
+           'bz2': range(1, 10)}
+
+# Size of the pieces the file is read in.
+CHUNK_SIZE = 64 * 1024
+
+# Operation logs are compacted once the operations take more room than
+# this and than the snapshot they apply to.
+COMPACT_BYTES = 1024 * 1024
+
+_ROW = ('{"id": %d, "name": %s, "type": %s, "amount": %s, "date": %d, '
+        '"category": %s}')
+
+_BLANK = re.compile(r'[ \t\n\r]*')
+
+
+class _JSONStream:
+    """Parses a JSON document piece by piece from a file.
+
+    Only the structure of the top level object and of the transactions
+    array is walked here, every other value is handed to the standard
+    decoder once it is entirely in the buffer.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # Drop what has been parsed already.
+        chunk = self.fd.read(CHUNK_SIZE)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+
+    def peek(self):
+        """Return the next non blank character, without consuming it."""
+        while True:
+            self.pos = _BLANK.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ''
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected %r in journal' % char)
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number may continue in the next chunk.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def items(self):
+        """Iterate over the (key, value) pairs of an object. The value
+        of transactions is an iterator over the array, which must be
+        consumed before moving on."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key == 'transactions':
+                yield key, self.elements()
+            else:
+                yield key, self.value()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect('}')
+                return
+
+    def elements(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+
+def _little_endian(column):
+    if sys.byteorder == 'big':
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def _encode_strings(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    lengths = array.array('I', [len(e) for e in encoded])
+    return _COUNT.pack(len(encoded)) + \
+        _little_endian(lengths).tobytes() + b''.join(encoded)
+
+
+def _decode_strings(payload, offset):
+    count, = _COUNT.unpack_from(payload, offset)
+    offset += _COUNT.size
+    lengths = array.array('I')
+    lengths.frombytes(payload[offset:offset + count * lengths.itemsize])
+    if sys.byteorder == 'big':
+        lengths.byteswap()
+    offset += count * lengths.itemsize
+
+    strings = []
+    for length in lengths:
+        strings.append(str(payload[offset:offset + length], 'utf-8'))
+        offset += length
+    return strings, offset
+
+
+def _used_strings(table, codes):
+    """Return the strings of table used by codes, and codes recoded to
+    index them."""
+    used = sorted(set(codes))
+    if len(used) == len(table):
+        return table.strings, codes
+    recode = dict((code, i) for i, code in enumerate(used))
+    return [table[code] for code in used], \
+        array.array(codes.typecode, map(recode.__getitem__, codes))
+
+
+class _FrozenLedger:
+    """Copy of the parts of a ledger a snapshot is encoded from.
+
+    Taking it only copies the flat columns, after which the ledger can
+    keep changing while the copy is encoded in another thread.
+    """
+
+    def __init__(self, book):
+        store = book.transactions
+        store.compact()
+        self.ids = store.ids[:]
+        self.dates = store.dates[:]
+        self.amounts = store.amounts[:]
+        self.types = store.types[:]
+        self.names = store.names[:]
+        self.categories = store.categories[:]
+        self.name_table = StringTable(store.name_table.strings)
+        self.category_table = StringTable(store.category_table.strings)
+        self.next_id = book.next_id
+        self.budgets = json.dumps(book.budgets)
+
+
+def _ordered(typecode, column, order):
+    return array.array(typecode, map(column.__getitem__, order))
+
+
+def _encode_columns(store, base):
+    """Return the payload of a columnar snapshot of a _FrozenLedger,
+    that will be written at offset base in the file."""
+    count = len(store.ids)
+    budgets = store.budgets.encode('utf-8')
+    names, name_codes = _used_strings(store.name_table, store.names)
+    categories, category_codes = _used_strings(store.category_table,
+                                               store.categories)
+
+    # The store is in id order, so sorting the slots by (date, slot)
+    # sorts the rows by (date, id).
+    keys = sorted((date << 32) | slot for slot, date in enumerate(store.dates))
+    order = [key & 0xffffffff for key in keys]
+    del keys
+
+    columns = {
+        'ids': _ordered('q', store.ids, order),
+        'amounts': _ordered('d', store.amounts, order),
+        'dates': _ordered('i', store.dates, order),
+        'names': _ordered('i', name_codes, order),
+        'categories': _ordered('i', category_codes, order),
+        'types': _ordered('b', store.types, order),
+        'sorted_ids': array.array('q', store.ids),
+    }
+
+    id_slots = array.array('i', bytes(4 * count))
+    for row, slot in enumerate(order):
+        id_slots[slot] = row
+    columns['id_slots'] = id_slots
+    del order
+
+    credits = [amount if type else 0.0 for amount, type in
+               zip(columns['amounts'], columns['types'])]
+    debits = [0.0 if type else amount for amount, type in
+              zip(columns['amounts'], columns['types'])]
+    columns['credit_total'] = array.array(
+        'd', itertools.accumulate(credits, initial=0.0))
+    columns['debit_total'] = array.array(
+        'd', itertools.accumulate(debits, initial=0.0))
+    columns['credit_count'] = array.array(
+        'q', itertools.accumulate(columns['types'], initial=0))
+    del credits, debits
+
+    parts = [
+        _SNAPSHOT_HEADER.pack(store.next_id, count, len(budgets)),
+        _encode_strings(names),
+        _encode_strings(categories),
+        budgets]
+    size = sum(len(part) for part in parts)
+    parts.append(bytes(-(base + size) % _ALIGNMENT))
+    for name, format, extra in _COLUMN_LAYOUT:
+        parts.append(_little_endian(columns.pop(name)).tobytes())
+    return b''.join(parts)
+
+
+def _decode_columns(payload, offset):
+    """Return a ledger over a columnar snapshot payload, which starts
+    at offset in the file, using views of the payload as columns."""
+    next_id, count, budgets_size = _SNAPSHOT_HEADER.unpack_from(payload)
+    pos = _SNAPSHOT_HEADER.size
+    names, pos = _decode_strings(payload, pos)
+    categories, pos = _decode_strings(payload, pos)
+    budgets = json.loads(bytes(payload[pos:pos + budgets_size]))
+    pos += budgets_size
+    pos += -(offset + pos) % _ALIGNMENT
+
+    columns = {}
+    for name, format, extra in _COLUMN_LAYOUT:
+        end = pos + (count + extra) * struct.calcsize(format)
+        column = payload[pos:end].cast(format)
+        if sys.byteorder == 'big':
+            column = array.array(format, column.tobytes())
+            column.byteswap()
+        columns[name] = column
+        pos = end
+
+    dates = columns['dates']
+    store = LedgerStore.mapped(
+        [columns['ids'], dates, columns['amounts'], columns['types'],
+         columns['names'], columns['categories']],
+        names, categories, columns['sorted_ids'], columns['id_slots'],
+        SortedDateIndex(dates, columns['ids']),
+        PrefixBalanceIndex(dates, columns['credit_total'],
+                           columns['debit_total'], columns['credit_count']))
+    return Ledger(store, next_id, budgets)
+
+
+def parse_codec(codec):
+    """Return (name, level) for a codec given as 'name' or 'name:level'.
+    """
+    name, sep, level = codec.partition(':')
+    if name not in CODECS:
+        raise ValueError('Unknown journal codec %r' % name)
+    if not sep:
+        return name, _DEFAULT_LEVELS[name]
+    if not level.isdigit() or int(level) not in _LEVELS[name]:
+        raise ValueError('Invalid level %r for journal codec %s' %
+                         (level, name))
+    return name, int(level)
+
+
+def _default_codec():
+    codec = os.environ.get('FINANCE_JOURNAL_CODEC', 'none')
+    try:
+        parse_codec(codec)
+    except ValueError as error:
+        logging.warning('FINANCE_JOURNAL_CODEC: %s, saving uncompressed',
+                        error)
+        return 'none'
+    return codec
+
+
+# FINANCE_JOURNAL_CODEC=<codec>[:<level>] compresses saved journals.
+DEFAULT_CODEC = _default_codec()
+
+
+def _compress(name, level, data):
+    if name == 'zlib':
+        return zlib.compress(data, level)
+    elif name == 'lzma':
+        import lzma
+        return lzma.compress(data, preset=level)
+    elif name == 'bz2':
+        import bz2
+        return bz2.compress(data, level)
+    return data
+
+
+def _decompress(codec, data):
+    if codec == CODECS['zlib']:
+        return zlib.decompress(data)
+    elif codec == CODECS['lzma']:
+        import lzma
+        return lzma.decompress(data)
+    elif codec == CODECS['bz2']:
+        import bz2
+        return bz2.decompress(data)
+    elif codec != CODECS['none']:
+        raise ValueError('Unknown journal codec %d' % codec)
+    return data
+
+
+def _write_record(fd, kind, payload):
+    fd.write(_RECORD.pack(kind, len(payload)))
+    fd.write(payload)
+    fd.write(_CRC.pack(zlib.crc32(payload)))
+    return _RECORD.size + len(payload) + _CRC.size
+
+
+def _read_record(fd):
+    """Return the next (kind, payload), or None at the end of the file
+    or of its intact part."""
+    header = fd.read(_RECORD.size)
+    if len(header) < _RECORD.size:
+        return None
+    kind, size = _RECORD.unpack(header)
+    payload = fd.read(size)
+    crc = fd.read(_CRC.size)
+    if len(payload) < size or len(crc) < _CRC.size or \
+            _CRC.unpack(crc)[0] != zlib.crc32(payload):
+        return None
+    return kind, payload
+
+
+def _read_binary(fd):
+    magic, version, flags = _HEADER.unpack(fd.read(_HEADER.size))
+    if version > VERSION:
+        raise ValueError('Journal format %d is too new' % version)
+    codec = flags & 0xff
+
+    start = fd.tell()
+    header = fd.read(_RECORD.size)
+    if len(header) < _RECORD.size:
+        raise ValueError('Journal snapshot is damaged')
+    kind, size = _RECORD.unpack(header)
+    if kind == COLUMNS and codec == 0:
+        # The snapshot is read in place from a memory map. Only the
+        # snapshot is mapped, the file may grow or shrink after it.
+        # Checking the CRC would mean reading the whole snapshot, which
+        # is what mapping it avoids.
+        offset = start + _RECORD.size
+        mapping = mmap.mmap(fd.fileno(), offset + size,
+                            access=mmap.ACCESS_READ)
+        book = _decode_columns(
+            memoryview(mapping)[offset:offset + size], offset)
+        fd.seek(offset + size + _CRC.size)
+    else:
+        fd.seek(start)
+        record = _read_record(fd)
+        if record is None or record[0] != COLUMNS:
+            raise ValueError('Journal snapshot is damaged')
+        payload = _decompress(codec, record[1])
+        book = _decode_columns(memoryview(payload), 0)
+    snapshot_size = end = fd.tell()
+
+    # Anything after a damaged record is an interrupted write.
+    while True:
+        record = _read_record(fd)
+        if record is None:
+            break
+        kind, payload = record
+        if kind == OPERATION:
+            _apply(book, json.loads(payload))
+        end = fd.tell()
+    return book, snapshot_size, end
+
+
+def _read_json_snapshot(stream):
+    book = None
+    next_id = 0
+    budgets = {}
+    for key, value in stream.items():
+        if key == 'transactions':
+            book = Ledger(value)
+        elif key == 'next_id':
+            next_id = value
+        elif key == 'budgets':
+            budgets = value
+
+    if book is None:
+        book = Ledger()
+    book.next_id = next_id
+    book.budgets = budgets
+    return book
+
+
+def _read_json(file_path):
+    fd = open(file_path, 'r')
+    try:
+        return _read_json_snapshot(_JSONStream(fd))
+    finally:
+        fd.close()
+
+
+def _apply(book, op):
+    store = book.transactions
+    kind = op[0]
+    if kind == 'create':
+        record = op[1]
+        if record['id'] in store:
+            store.replace(record)
+        else:
+            store.insert(record)
+    elif kind == 'update':
+        for field, value in op[2].items():
+            store.set_field(op[1], field, value)
+    elif kind == 'delete':
+        if op[1] in store:
+            store.remove(op[1])
+    elif kind == 'meta':
+        book.next_id = op[1]['next_id']
+        book.budgets = op[1]['budgets']
+
+
+def _is_binary(file_path):
+    fd = open(file_path, 'rb')
+    try:
+        return fd.read(len(MAGIC)) == MAGIC
+    finally:
+        fd.close()
+
+
+def _read(file_path):
+    """Return the ledger in a journal file, with the size of its
+    snapshot and of its intact part if it is in the binary format, or
+    None for both otherwise."""
+    fd = open(file_path, 'rb')
+    try:
+        if fd.read(len(MAGIC)) == MAGIC:
+            fd.seek(0)
+            book, snapshot_size, end = _read_binary(fd)
+        else:
+            book, snapshot_size, end = None, None, None
+    finally:
+        fd.close()
+
+    if book is None:
+        book = _read_json(file_path)
+
+    # Replaying the operations is not something to undo.
+    book.undo_log.clear()
+    book.build_names()
+    return book, snapshot_size, end
+
+
+def read(file_path):
+    """Load a ledger from a journal file, in the binary format or in
+    the JSON format of earlier versions.
+
+    The transactions of a binary journal are read in place from a
+    memory map of the file until they are first changed, so the file
+    must not be modified meanwhile.
+    """
+    return _read(file_path)[0]
+
+
+def _sync(fd):
+    fd.flush()
+    os.fsync(fd.fileno())
+
+
+def _write_snapshot_file(frozen, file_path, codec):
+    """Write a binary journal of just a snapshot of a _FrozenLedger,
+    compressed with codec, a (name, level) pair.
+
+    The file is written and synced under a temporary name and then
+    renamed over file_path, so that an interrupted write never replaces
+    a good file. Returns its size.
+    """
+    name, level = codec
+    temp_path = file_path + '.tmp'
+    fd = open(temp_path, 'wb')
+    try:
+        fd.write(_HEADER.pack(MAGIC, VERSION, CODECS[name] | level << 8))
+        if name == 'none':
+            payload = _encode_columns(frozen, _HEADER.size + _RECORD.size)
+        else:
+            payload = _compress(name, level, _encode_columns(frozen, 0))
+        _write_record(fd, COLUMNS, payload)
+        del payload
+        size = fd.tell()
+        _sync(fd)
+    except Exception:
+        fd.close()
+        os.remove(temp_path)
+        raise
+    fd.close()
+    os.replace(temp_path, file_path)
+    return size
+
+
+def write(book, file_path, codec=None):
+    """Save a ledger as a binary journal, compressed with codec, see
+    parse_codec, or DEFAULT_CODEC."""
+    _write_snapshot_file(_FrozenLedger(book), file_path,
+                         parse_codec(codec or DEFAULT_CODEC))
+
+
+def write_json(book, file_path):
+    """Save a ledger as a JSON journal, one transaction at a time, as
+    earlier versions did."""
+    store = book.transactions
+    store.compact()
+    # Names and categories are encoded once per distinct string.
+    names = [json.dumps(s) for s in store.name_table.strings]
+    categories = [json.dumps(s) for s in store.category_table.strings]
+    types = ('"debit"', '"credit"')
+
+    fd = open(file_path, 'w')
+    try:
+        fd.write('{"next_id": %s, "transactions": [' %
+                 json.dumps(book.next_id))
+        rows = zip(store.ids, store.names, store.types, store.amounts,
+                   store.dates, store.categories)
+        for i, (id, name, type, amount, date, category) in enumerate(rows):
+            if i:
+                fd.write(', ')
+            fd.write(_ROW % (id, names[name], types[type], repr(amount),
+                             date, categories[category]))
+        fd.write('], "budgets": %s}' % json.dumps(book.budgets))
+    finally:
+        fd.close()
+
+
+# Saves a ledger by appending to a working file.
+#
+# The working file is a binary journal: a snapshot record of the
+# ledger, followed by one operation record per change made since, each
+# holding one of
+#
+#     ["create", {transaction}]
+#     ["update", id, {field: value, ...}]
+#     ["delete", id]
+#     ["meta", {"next_id": next_id, "budgets": budgets}]
+#
+# as JSON. Changes are collected from the ledger store between saves,
+# several edits of the same transaction becoming a single operation.
+# Once the operations outgrow COMPACT_BYTES and the snapshot, the file
+# is rewritten as a fresh snapshot. So is a changed file before it is
+# copied out, as replaying operations would turn the ledger read from
+# the copy from a mapped one into arrays.
+
+class OpLog:
+    _CREATED = 'created'
+    _DELETED = 'deleted'
+
+    def __init__(self, book, path, codec=None):
+        self.book = book
+        self.path = path
+        self.codec = parse_codec(codec or DEFAULT_CODEC)
+        # Size of the snapshot in the working file, None while there
+        # is no working file yet.
+        self.snapshot_size = None
+        self.log_size = 0
+
+        self._pending = {}
+        self._meta = None
+        self._job = None
+        book.transactions.listeners.append(self.record)
+
+    @classmethod
+    def open(cls, file_path, path):
+        """Load the ledger from a journal file, continuing its log in
+        the working file at path if it is a binary journal. Other
+        files are upgraded by the first save."""
+        if not _is_binary(file_path):
+            log = cls(_read(file_path)[0], path)
+            log._meta = log._get_meta()
+            return log
+
+        # The ledger may be mapped from the file, so it is read from
+        # the working copy, which stays around. A ledger may still be
+        # mapped from the previous working copy, so that one is
+        # replaced rather than overwritten.
+        shutil.copyfile(file_path, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        book, snapshot_size, end = _read(path)
+        # New operations must not follow an interrupted write.
+        os.truncate(path, end)
+        log = cls(book, path)
+        log._meta = log._get_meta()
+        log.snapshot_size = snapshot_size
+        log.log_size = end - snapshot_size
+        return log
+
+    def record(self, kind, id, field=None, old=None, new=None):
+        """LedgerStore listener, called for every change."""
+        if kind == EXTEND:
+            self._pending.update(dict.fromkeys(id, self._CREATED))
+            return
+        state = self._pending.get(id)
+        if kind == CREATE:
+            self._pending[id] = self._CREATED
+        elif kind == ERASE:
+            self._pending[id] = self._DELETED
+        elif state is None:
+            self._pending[id] = {field}
+        elif isinstance(state, set):
+            state.add(field)
+
+    def _get_meta(self):
+        return json.dumps({'next_id': self.book.next_id,
+                           'budgets': self.book.budgets})
+
+    def _changed(self):
+        return bool(self._pending) or self._get_meta() != self._meta
+
+    def _operations(self):
+        store = self.book.transactions
+        for id, state in self._pending.items():
+            if id not in store:
+                yield ['delete', id]
+            elif state == self._CREATED:
+                yield ['create', store.get_record(id)]
+            elif state != self._DELETED:
+                yield ['update', id,
+                       {field: store.get_field(id, field)
+                        for field in state}]
+
+        meta = self._get_meta()
+        if meta != self._meta:
+            yield ['meta', json.loads(meta)]
+
+    def save(self, copy_path=None):
+        """Bring the working file up to date with the ledger, and copy
+        it to copy_path if given, as a single snapshot."""
+        job = self.start_save(copy_path)
+        job.join()
+        if job.error is not None:
+            raise job.error
+
+    def start_save(self, copy_path=None, done=None):
+        """Start save() in a worker thread, and return the thread.
+
+        What is to be saved is copied first, so the ledger can keep
+        changing while the thread runs; those changes are left for the
+        next save. The thread has an error attribute, and calls
+        done(error) when it is finished if given. A save started while
+        another one runs waits for it.
+        """
+        if self._job is not None:
+            self._job.join()
+
+        compact = self.snapshot_size is None or \
+            self.log_size > max(COMPACT_BYTES, self.snapshot_size)
+        if copy_path is not None and (self.log_size or self._changed()):
+            compact = True
+        if compact:
+            work = self._compact_work(_FrozenLedger(self.book))
+        else:
+            payloads = [json.dumps(op).encode('utf-8')
+                        for op in self._operations()]
+            work = self._append_work(payloads)
+        self._pending = {}
+        self._meta = self._get_meta()
+
+        self._job = _SaveJob(self, work, copy_path, done)
+        self._job.start()
+        return self._job
+
+    def _compact_work(self, frozen):
+        def work():
+            self.snapshot_size = _write_snapshot_file(frozen, self.path,
+                                                      self.codec)
+            self.log_size = 0
+        return work
+
+    def _append_work(self, payloads):
+        def work():
+            if not payloads:
+                return
+            fd = open(self.path, 'ab')
+            try:
+                for payload in payloads:
+                    self.log_size += _write_record(fd, OPERATION, payload)
+                _sync(fd)
+            finally:
+                fd.close()
+        return work
+
+    def _failed(self):
+        # The pending changes are gone, and the working file may end
+        # with a damaged record, so the next save writes a snapshot.
+        self.snapshot_size = None
+
+    def compact(self):
+        """Rewrite the working file as a snapshot of the ledger."""
+        self.snapshot_size = None
+        self.save()
+
+
+class _SaveJob(threading.Thread):
+    def __init__(self, log, work, copy_path, done):
+        threading.Thread.__init__(self, name='finance-save', daemon=True)
+        self.log = log
+        self.work = work
+        self.copy_path = copy_path
+        self.done = done
+        self.error = None
+
+    def run(self):
+        try:
+            self.work()
+            if self.copy_path is not None:
+                shutil.copyfile(self.log.path, self.copy_path)
+        except Exception as error:
+            self.error = error
+            self.log._failed()
+        if self.done is not None:
+            self.done(self.error)
@@ -0,0 +1,289 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The Finance ledger, without any user interface.
+
+Nothing in here imports Gtk, sugar3 or dbus, so the ledger can be
+loaded, edited and summarized from plain Python scripts.
+"""
+
+# Import standard Python modules.
+import datetime
+
+from fingerprints import FingerprintIndex
+from ledgerstore import LedgerStore
+from rollup import Rollup
+from undolog import UndoLog
+
+DAY = 0
+WEEK = 1
+MONTH = 2
+YEAR = 3
+FOREVER = 4
+
+# All transactions fall in the one FOREVER period, whatever its start.
+_FOREVER_START = datetime.date(1900, 1, 1).toordinal()
+
+
+def get_this_period(period, today=None):
+    """Return the first day of the period containing today."""
+    if today is None:
+        today = datetime.date.today()
+
+    if period == DAY:
+        return today
+
+    elif period == WEEK:
+        return today - datetime.timedelta(days=today.weekday())
+
+    elif period == MONTH:
+        return datetime.date(today.year, today.month, 1)
+
+    elif period == YEAR:
+        return datetime.date(today.year, 1, 1)
+
+    elif period == FOREVER:
+        return datetime.date(1900, 1, 1)
+
+
+def get_next_period(period, start):
+    if period == DAY:
+        return start + datetime.timedelta(days=1)
+
+    elif period == WEEK:
+        return start + datetime.timedelta(days=7)
+
+    elif period == MONTH:
+        if start.month == 12:
+            return datetime.date(start.year + 1, 1, 1)
+        else:
+            return datetime.date(start.year, start.month + 1, 1)
+
+    elif period == YEAR:
+        return datetime.date(start.year + 1, 1, 1)
+
+
+def get_prev_period(period, start):
+    if period == DAY:
+        return start - datetime.timedelta(days=1)
+
+    elif period == WEEK:
+        return start - datetime.timedelta(days=7)
+
+    elif period == MONTH:
+        if start.month == 1:
+            return datetime.date(start.year - 1, 12, 1)
+        else:
+            return datetime.date(start.year, start.month - 1, 1)
+
+    elif period == YEAR:
+        return datetime.date(start.year - 1, 1, 1)
+
+
+def get_period_starts(date):
+    """Return the ordinals of the first day of the DAY, WEEK, MONTH,
+    YEAR and FOREVER periods containing a date ordinal, in that order.
+    """
+    d = datetime.date.fromordinal(date)
+    return (date, date - d.weekday(),
+            date - d.day + 1,
+            datetime.date(d.year, 1, 1).toordinal(),
+            _FOREVER_START)
+
+
+def get_period_label(period, start):
+    """Return a short label for the period starting on a date ordinal.
+    """
+    d = datetime.date.fromordinal(start)
+    if period == DAY:
+        return d.isoformat()
+    elif period == WEEK:
+        year, week, day = d.isocalendar()
+        return '%d-W%02d' % (year, week)
+    elif period == MONTH:
+        return '%s-%s' % (d.year, d.month)
+    elif period == YEAR:
+        return str(d.year)
+
+
+def get_period_range(period, start):
+    """Return the [start, end) date ordinals of a period, end is None
+    for FOREVER."""
+    if period == FOREVER:
+        return start.toordinal(), None
+    return start.toordinal(), get_next_period(period, start).toordinal()
+
+
+# The ledger: transactions, budgets and the undo history.
+#
+# The Finance activity wraps one of these and only adds the screens on
+# top. Transactions live in a LedgerStore, whose changes are recorded by
+# the undo log.
+
+class Ledger:
+    """transactions is either an iterable of transaction dicts or a
+    ready made LedgerStore."""
+
+    def __init__(self, transactions=(), next_id=0, budgets=None):
+        self.next_id = next_id
+        self.budgets = budgets if budgets is not None else {}
+
+        if isinstance(transactions, LedgerStore):
+            self.transactions = transactions
+        else:
+            self.transactions = LedgerStore(transactions)
+        self.undo_log = UndoLog()
+        self.transactions.listeners.append(self.undo_log.record)
+        self.rollup = Rollup(self.transactions, FOREVER + 1,
+                             get_period_starts)
+        self.fingerprints = FingerprintIndex(self.transactions)
+
+        self.transaction_names = {}
+        self.category_names = {}
+        self.build_names()
+
+    def __len__(self):
+        return len(self.transactions)
+
+    @property
+    def version(self):
+        return self.transactions.version
+
+    def create_transaction(self, name='', type='debit', amount=0,
+                           category='', date=None):
+        if date is None:
+            date = datetime.date.today()
+        return self.create_transactions([{
+            'name': name,
+            'type': type,
+            'amount': amount,
+            'date': date,
+            'category': category
+        }])[0]
+
+    def create_transactions(self, records):
+        """Add many transactions as a single undo step.
+
+        records is an iterable of dicts with the create_transaction
+        arguments as keys. The ids of the new transactions are returned.
+        """
+        transactions = []
+        for record in records:
+            id = self.next_id
+            self.next_id += 1
+
+            t = {
+                'id': id,
+                'name': record.get('name', ''),
+                'type': record.get('type', 'debit'),
+                'amount': record.get('amount', 0),
+                'date': record['date'].toordinal(),
+                'category': record.get('category', '')
+            }
+            transactions.append(t)
+
+            self.transaction_names[t['name']] = 1
+            if t['category'] != '':
+                self.category_names[t['category']] = 1
+
+        with self.undo_log.group():
+            return self.transactions.extend(transactions)
+
+    def destroy_transaction(self, id):
+        self.transactions.remove(id)
+
+    def undo(self):
+        return self.undo_log.undo(self.transactions)
+
+    def redo(self):
+        return self.undo_log.redo(self.transactions)
+
+    def build_names(self):
+        self.transaction_names = {}
+        self.category_names = {}
+        for name in self.transactions.used_names():
+            self.transaction_names[name] = 1
+        for category in self.transactions.used_categories():
+            self.category_names[category] = 1
+
+    def visible_ids(self, period, period_start):
+        """Return the ids of the transactions in a period, by date."""
+        start, end = get_period_range(period, period_start)
+        if period == FOREVER:
+            start = None
+        return self.transactions.date_index.ids(start, end)
+
+    def iter_visible_ids(self, period, period_start):
+        """Like visible_ids, one id at a time."""
+        start, end = get_period_range(period, period_start)
+        if period == FOREVER:
+            start = None
+        return self.transactions.date_index.iter_ids(start, end)
+
+    def visible_span(self, period, period_start):
+        """Return the first and last date ordinal of the transactions in
+        a period, or None if there are none."""
+        start, end = get_period_range(period, period_start)
+        if period == FOREVER:
+            start = None
+        return self.transactions.date_index.span(start, end)
+
+    def summary(self, period, period_start):
+        """Return (start_balance, credit_total, credit_count,
+        debit_total, debit_count) for a period."""
+        start, end = get_period_range(period, period_start)
+        # FOREVER holds every transaction, like its register does, so
+        # nothing comes before it.
+        if period == FOREVER:
+            start = None
+        balance_index = self.transactions.balance_index
+        balance = balance_index.balance_before(start)
+        # Building the rollup costs a pass over the rows, which the
+        # first paint of a freshly loaded ledger should not wait for.
+        if not self.rollup.built:
+            return (balance,) + balance_index.totals(start, end)
+        return (balance,) + \
+            self.rollup.totals(period, self._bucket(period, period_start))
+
+    def category_totals(self, period, period_start, type_movement):
+        """Return {category: total} of one type of transaction in a
+        period."""
+        return self.rollup.category_totals(
+            period, self._bucket(period, period_start),
+            type_movement == 'credit')
+
+    def _bucket(self, period, period_start):
+        if period == FOREVER:
+            return _FOREVER_START
+        return period_start.toordinal()
+
+    def export_groups(self, type_movement, period):
+        """Return [label, total] pairs of the transactions of one type,
+        grouped by DAY, WEEK, MONTH or YEAR, in date order."""
+        series = self.rollup.series(period, type_movement == 'credit')
+        return [[get_period_label(period, bucket),
+                 round(sum(totals.values()), 6)]
+                for bucket, totals in series]
+
+    def export_series(self, type_movement, period):
+        """Return {category: [label, total] pairs} like export_groups,
+        with one series per category."""
+        series = {}
+        for bucket, totals in self.rollup.series(
+                period, type_movement == 'credit'):
+            label = get_period_label(period, bucket)
+            for category, total in totals.items():
+                series.setdefault(category, []).append([label, total])
+        return series
@@ -0,0 +1,462 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import standard Python modules.
+import array
+import bisect
+import itertools
+
+from dateindex import DateIndex
+from balanceindex import BalanceIndex
+from undolog import CREATE, ERASE, EXTEND, SET
+
+FIELDS = ('id', 'name', 'type', 'amount', 'date', 'category')
+
+# The type column stores a flag instead of the type string.
+DEBIT = 0
+CREDIT = 1
+
+# Name code marking the slot of an erased transaction.
+_DEAD = -1
+
+# Compact once this many slots are dead and they outnumber the live ones.
+_COMPACT_THRESHOLD = 1024
+
+_COLUMNS = ('ids', 'dates', 'amounts', 'types', 'names', 'categories')
+_TYPECODES = {'ids': 'q', 'dates': 'l', 'amounts': 'd', 'types': 'b',
+              'names': 'l', 'categories': 'l'}
+
+# Shared by all stores, so a freshly loaded ledger never reuses the
+# version of the one it replaces.
+_versions = itertools.count()
+
+
+class StringTable:
+    """Interns strings as small integer codes."""
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self.codes = {s: code for code, s in enumerate(self.strings)}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, code):
+        return self.strings[code]
+
+    def intern(self, s):
+        code = self.codes.get(s)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(s)
+            self.codes[s] = code
+        return code
+
+
+class _IdMap:
+    """Read-only id -> slot mapping, over the ids in ascending order and
+    the slot of each of them."""
+
+    def __init__(self, ids, slots):
+        self.ids = ids
+        self.slots = slots
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _find(self, id):
+        i = bisect.bisect_left(self.ids, id)
+        if i < len(self.ids) and self.ids[i] == id:
+            return i
+        return -1
+
+    def __contains__(self, id):
+        return self._find(id) >= 0
+
+    def __getitem__(self, id):
+        i = self._find(id)
+        if i < 0:
+            raise KeyError(id)
+        return self.slots[i]
+
+    def keys(self):
+        return self.ids.tolist()
+
+    def values(self):
+        return self.slots.tolist()
+
+
+class Transaction:
+    """Dict-like view of one row of a LedgerStore.
+
+    Reading or assigning a key goes straight to the store columns, so
+    code written against the old per-transaction dicts keeps working
+    and the store indexes stay up to date.
+    """
+
+    __slots__ = ('_store', 'id')
+
+    def __init__(self, store, id):
+        self._store = store
+        self.id = id
+
+    def __getitem__(self, key):
+        return self._store.get_field(self.id, key)
+
+    def __setitem__(self, key, value):
+        self._store.set_field(self.id, key, value)
+
+    def __contains__(self, key):
+        return key in FIELDS
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def get(self, key, default=None):
+        if key in FIELDS:
+            return self[key]
+        return default
+
+    def keys(self):
+        return FIELDS
+
+    def items(self):
+        return [(key, self[key]) for key in FIELDS]
+
+    def copy(self):
+        return self._store.get_record(self.id)
+
+
+# Column oriented transaction storage.
+#
+# Every transaction is a slot in a set of parallel arrays: id, date
+# ordinal, amount and type flag, plus codes into string tables for the
+# name and category. An id -> slot map makes lookups, replacements and
+# erasing constant time. Erased slots are left behind as tombstones, so
+# undoing an erase revives the transaction in place, and the arrays are
+# compacted once tombstones pile up. Slots are normally in id order,
+# which is also the order used when the ledger is written to the
+# journal; compacting restores that order if a reinsert broke it.
+#
+# Every change bumps version, which also becomes the row version of the
+# transaction, and is reported to the callables in listeners as (kind,
+# id, field, old, new), see undolog.UndoLog.record. extend() reports
+# all its transactions in one EXTEND call, with the list of their ids.
+#
+# A store can also be mapped, see LedgerStore.mapped: the columns are
+# then read-only views of a journal file in date order, and the store
+# is only turned into arrays the first time it is changed.
+
+class LedgerStore:
+    def __init__(self, transactions=()):
+        self.ids = array.array('q')
+        self.dates = array.array('l')
+        self.amounts = array.array('d')
+        self.types = array.array('b')
+        self.names = array.array('l')
+        self.categories = array.array('l')
+
+        self.name_table = StringTable()
+        self.category_table = StringTable()
+
+        self._slots = {}
+        self._tombstones = {}
+        self._sorted = True
+        self._mapped = False
+
+        self.version = next(_versions)
+        self.listeners = []
+        self._row_versions = {}
+        self._first_version = self.version
+
+        # Rows are taken one at a time, so transactions may be a stream.
+        for t in transactions:
+            if self.ids and t['id'] < self.ids[-1]:
+                self._sorted = False
+            self._append_columns(t)
+        self._build_indexes()
+
+    @classmethod
+    def mapped(cls, columns, names, categories, sorted_ids, id_slots,
+               date_index, balance_index):
+        """Build a store over read-only column views.
+
+        columns are in the order of _COLUMNS with the rows sorted by
+        date, names and categories hold exactly the strings in use.
+        sorted_ids are the ids in ascending order and id_slots the row
+        of each of them. The indexes are a SortedDateIndex and a
+        PrefixBalanceIndex over the same rows.
+        """
+        store = cls()
+        for name, column in zip(_COLUMNS, columns):
+            setattr(store, name, column)
+        store.name_table = StringTable(names)
+        store.category_table = StringTable(categories)
+        store._slots = _IdMap(sorted_ids, id_slots)
+        store._sorted = False
+        store._mapped = True
+        store.date_index = date_index
+        store.balance_index = balance_index
+        return store
+
+    def _materialize(self):
+        """Copy the columns of a mapped store into arrays, so that it
+        can be changed."""
+        if not self._mapped:
+            return
+        for name in _COLUMNS:
+            column = getattr(self, name)
+            typecode = _TYPECODES[name]
+            if array.array(typecode).itemsize == column.itemsize:
+                # Same layout, so the column is copied as one block.
+                column = column.tobytes()
+            setattr(self, name, array.array(typecode, column))
+        self._mapped = False
+
+        # The rows stay in date order, with no tombstones, so the
+        # indexes are built straight from the columns.
+        self._build_slots()
+        self.date_index = DateIndex.from_sorted(self.dates, self.ids)
+        self.balance_index = BalanceIndex.from_sorted(
+            self.dates, self.amounts, self.types)
+
+    def _build_indexes(self):
+        self._build_slots()
+        if not self._sorted:
+            self.compact()
+
+        self.date_index = DateIndex()
+        self.date_index.add_many(zip(self.ids, self.dates))
+        self.balance_index = BalanceIndex.from_columns(
+            self.dates, self.amounts, self.types)
+
+    def _build_slots(self):
+        self._slots = dict(zip(self.ids, range(len(self.ids))))
+
+    def _append_columns(self, t):
+        self.ids.append(t['id'])
+        self.dates.append(t['date'])
+        self.amounts.append(t['amount'])
+        self.types.append(CREDIT if t['type'] == 'credit' else DEBIT)
+        self.names.append(self.name_table.intern(t['name']))
+        self.categories.append(self.category_table.intern(t['category']))
+
+    def _write_columns(self, slot, t):
+        self.dates[slot] = t['date']
+        self.amounts[slot] = t['amount']
+        self.types[slot] = CREDIT if t['type'] == 'credit' else DEBIT
+        self.names[slot] = self.name_table.intern(t['name'])
+        self.categories[slot] = self.category_table.intern(t['category'])
+
+    def _index(self, id):
+        t = Transaction(self, id)
+        self.date_index.add(id, t['date'])
+        self.balance_index.add(t)
+
+    def _unindex(self, id):
+        t = Transaction(self, id)
+        self.date_index.remove(id, t['date'])
+        self.balance_index.remove(t)
+
+    def _notify(self, kind, id, field=None, old=None, new=None):
+        self.version = next(_versions)
+        self._row_versions[id] = self.version
+        for listener in self.listeners:
+            listener(kind, id, field, old, new)
+
+    def _notify_extend(self, ids):
+        self.version = next(_versions)
+        self._row_versions.update(dict.fromkeys(ids, self.version))
+        for listener in self.listeners:
+            listener(EXTEND, ids, None, None, None)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, id):
+        return id in self._slots
+
+    def __getitem__(self, id):
+        if id not in self._slots:
+            raise KeyError(id)
+        return Transaction(self, id)
+
+    def __iter__(self):
+        for id in self._live_ids():
+            yield Transaction(self, id)
+
+    def _live_ids(self):
+        if self._mapped:
+            return self._slots.keys()
+        if not self._sorted:
+            self.compact()
+        names = self.names
+        return [id for slot, id in enumerate(self.ids)
+                if names[slot] != _DEAD]
+
+    def keys(self):
+        return self._slots.keys()
+
+    def row_version(self, id):
+        """Return the version of the last change to one transaction."""
+        return self._row_versions.get(id, self._first_version)
+
+    def live_slots(self):
+        """Return the slots of the transactions, in no particular order.
+        """
+        return self._slots.values()
+
+    def slots(self, ids):
+        """Return the slots of some transactions."""
+        slots = self._slots
+        return [slots[id] for id in ids]
+
+    def get_field(self, id, key):
+        slot = self._slots[id]
+        if key == 'id':
+            return id
+        elif key == 'date':
+            return self.dates[slot]
+        elif key == 'amount':
+            return self.amounts[slot]
+        elif key == 'type':
+            return 'credit' if self.types[slot] == CREDIT else 'debit'
+        elif key == 'name':
+            return self.name_table[self.names[slot]]
+        elif key == 'category':
+            return self.category_table[self.categories[slot]]
+        raise KeyError(key)
+
+    def set_field(self, id, key, value):
+        old = self.get_field(id, key)
+        if old == value or key == 'id':
+            return
+        self._materialize()
+        slot = self._slots[id]
+        if key == 'name':
+            self.names[slot] = self.name_table.intern(value)
+        elif key == 'category':
+            self.categories[slot] = self.category_table.intern(value)
+        elif key in ('date', 'amount', 'type'):
+            self._unindex(id)
+            if key == 'date':
+                self.dates[slot] = value
+            elif key == 'amount':
+                self.amounts[slot] = value
+            else:
+                self.types[slot] = CREDIT if value == 'credit' else DEBIT
+            self._index(id)
+        self._notify(SET, id, key, old, value)
+
+    def get_record(self, id):
+        """Return a plain dict copy of a transaction."""
+        return {key: self.get_field(id, key) for key in FIELDS}
+
+    def extend(self, transactions):
+        """Append many new transactions, updating the indexes once."""
+        self._materialize()
+        transactions = list(transactions)
+        ids = []
+        for t in transactions:
+            self._append_columns(t)
+            self._slots[t['id']] = len(self.ids) - 1
+            ids.append(t['id'])
+
+        self.date_index.add_many((t['id'], t['date']) for t in transactions)
+        self.balance_index.add_many(transactions)
+        self._notify_extend(ids)
+        return ids
+
+    def insert(self, t):
+        """Add back an erased transaction, keeping its id."""
+        self._materialize()
+        id = t['id']
+        slot = self._tombstones.pop(id, None)
+        if slot is not None:
+            self._write_columns(slot, t)
+        else:
+            if self.ids and id < self.ids[-1]:
+                self._sorted = False
+            self._append_columns(t)
+            slot = len(self.ids) - 1
+        self._slots[id] = slot
+        self._index(id)
+        self._notify(CREATE, id)
+        return Transaction(self, id)
+
+    def replace(self, t):
+        """Overwrite every field of an existing transaction."""
+        for key in FIELDS:
+            self.set_field(t['id'], key, t[key])
+
+    def remove(self, id):
+        self._materialize()
+        record = self.get_record(id)
+        self._unindex(id)
+        slot = self._slots.pop(id)
+        self.names[slot] = _DEAD
+        self.categories[slot] = _DEAD
+        self._tombstones[id] = slot
+        self._notify(ERASE, id, old=record)
+
+        dead = len(self.ids) - len(self._slots)
+        if dead >= _COMPACT_THRESHOLD and dead > len(self._slots):
+            self.compact()
+
+    def compact(self):
+        """Drop the tombstones and put the slots back in id order."""
+        self._materialize()
+        if self._sorted and not self._tombstones:
+            return
+        live = sorted(self._slots.values(), key=self.ids.__getitem__)
+        for name in _COLUMNS:
+            column = getattr(self, name)
+            setattr(self, name, array.array(
+                column.typecode, [column[slot] for slot in live]))
+        self._build_slots()
+        self._tombstones = {}
+        self._sorted = True
+
+    def used_names(self):
+        if self._mapped:
+            return list(self.name_table.strings)
+        return [self.name_table[code] for code in set(self.names)
+                if code != _DEAD]
+
+    def used_categories(self):
+        if self._mapped:
+            return list(self.category_table.strings)
+        return [self.category_table[code] for code in set(self.categories)
+                if code != _DEAD]
+
+    def last_category(self, name):
+        """Return the category of the latest transaction called name."""
+        code = self.name_table.codes.get(name)
+        empty = self.category_table.codes.get('')
+        if code is None:
+            return ''
+        if self._mapped:
+            slots = reversed(self._slots.values())
+        else:
+            slots = reversed(range(len(self.names)))
+        for slot in slots:
+            if self.names[slot] == code and \
+                    self.categories[slot] != empty:
+                return self.category_table[self.categories[slot]]
+        return ''
+
+    def to_list(self):
+        """Return the transactions as dicts, for serialization."""
+        return [self.get_record(id) for id in self._live_ids()]
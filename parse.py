@@ -1,5 +1,4 @@
 #!/usr/bin/python3
-from gi.repository import Gtk
 import locale
 import ast
 import operator
@@ -7,9 +6,6 @@ import re
 import logging
 from gettext import gettext as _
 
-from sugar3.graphics.alert import Alert
-from sugar3.graphics.icon import Icon
-
 
 def evaluate(value):
     try:
@@ -58,6 +54,11 @@ def evaluate(value):
 
 
 def invalid_value_alert(activity):
+    # Imported here, so that evaluate works without Gtk.
+    from gi.repository import Gtk
+    from sugar3.graphics.alert import Alert
+    from sugar3.graphics.icon import Icon
+
     alert = Alert()
 
     alert.props.title = _('Invalid Value')
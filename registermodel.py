@@ -0,0 +1,121 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import Gtk
+from gi.repository import GObject
+
+
+# A list model over the visible transaction ids.
+#
+# Rows are served straight from the id list the activity builds for the
+# period, nothing is copied into a Gtk store. The only column is the
+# transaction id. An iter holds its row number plus one in user_data,
+# since a zero pointer reads back as None. Replacing the whole list
+# emits no signals: detach the model from the view first, see
+# RegisterScreen.build. Single row changes emit the usual row signals.
+
+class RegisterModel(GObject.Object, Gtk.TreeModel):
+    def __init__(self, ids=()):
+        GObject.Object.__init__(self)
+        self.ids = list(ids)
+        self._stamp = 0
+
+    def set_ids(self, ids):
+        """Replace every row, while no view shows the model."""
+        self.ids = ids
+        self._stamp += 1
+
+    def get_id(self, iter):
+        return self.ids[iter.user_data - 1]
+
+    def get_id_at(self, path):
+        return self.ids[int(str(path).split(':')[0])]
+
+    def _make_iter(self, row):
+        iter = Gtk.TreeIter()
+        iter.stamp = self._stamp
+        iter.user_data = row + 1
+        return iter
+
+    def append(self, id):
+        self.ids.append(id)
+        row = len(self.ids) - 1
+        iter = self._make_iter(row)
+        self.row_inserted(Gtk.TreePath((row,)), iter)
+        return iter
+
+    def remove_row(self, row):
+        del self.ids[row]
+        self.row_deleted(Gtk.TreePath((row,)))
+
+    def changed(self, path):
+        row = int(str(path).split(':')[0])
+        self.row_changed(Gtk.TreePath((row,)), self._make_iter(row))
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns(self):
+        return 1
+
+    def do_get_column_type(self, column):
+        return GObject.TYPE_INT64
+
+    def do_get_iter(self, path):
+        indices = path.get_indices()
+        if len(indices) == 1 and 0 <= indices[0] < len(self.ids):
+            return True, self._make_iter(indices[0])
+        return False, None
+
+    def do_get_path(self, iter):
+        return Gtk.TreePath((iter.user_data - 1,))
+
+    def do_get_value(self, iter, column):
+        return self.ids[iter.user_data - 1]
+
+    def do_iter_next(self, iter):
+        row = iter.user_data
+        if row < len(self.ids):
+            iter.user_data = row + 1
+            return True
+        return False
+
+    def do_iter_previous(self, iter):
+        row = iter.user_data - 1
+        if row > 0:
+            iter.user_data = row
+            return True
+        return False
+
+    def do_iter_children(self, parent):
+        if parent is None and self.ids:
+            return True, self._make_iter(0)
+        return False, None
+
+    def do_iter_has_child(self, iter):
+        return False
+
+    def do_iter_n_children(self, iter):
+        if iter is None:
+            return len(self.ids)
+        return 0
+
+    def do_iter_nth_child(self, parent, n):
+        if parent is None and 0 <= n < len(self.ids):
+            return True, self._make_iter(n)
+        return False, None
+
+    def do_iter_parent(self, child):
+        return False, None
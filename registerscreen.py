@@ -17,10 +17,10 @@
 # Import standard Python modules.
 import time
 import datetime
-import locale
 from gettext import gettext as _
 import logging
 import copy
+import collections
 
 from gi.repository import Gtk
 from gi.repository import GObject
@@ -30,9 +30,19 @@ from sugar3.graphics import style
 
 # Import activity module
 import colors
+from currency import format_currency
+from registermodel import RegisterModel
 from parse import evaluate
 from parse import invalid_value_alert
 
+# Formatted rows kept by RegisterScreen, the cache starts over once full.
+ROW_CACHE_SIZE = 4096
+
+# What the cells of a transaction show, see RegisterScreen.get_row.
+_Row = collections.namedtuple(
+    '_Row', ('version', 'name', 'date', 'amount', 'category',
+             'category_background', 'category_foreground', 'foreground'))
+
 REGISTER_HELP = _(
     'Welcome to Finance! This activity keeps track of income '
     'and expenses for anything that earns or spends money, like a school '
@@ -56,11 +66,12 @@ class RegisterScreen(Gtk.VBox):
         font = Pango.FontDescription("Sans %d" % font_size)
         self.treeview.modify_font(font)
 
-        # Note that the only thing we store in our liststore is the
-        # transaction id. All the actual data is in the activity
-        # database.
-        self.liststore = Gtk.ListStore(GObject.TYPE_INT)
-        self.treeview.set_model(self.liststore)
+        # Note that the only thing in the model is the transaction id.
+        # All the actual data is in the activity database. Rows all have
+        # the same height, so the view never measures them.
+        self.model = RegisterModel()
+        self.treeview.set_model(self.model)
+        self.treeview.set_fixed_height_mode(True)
         sep = style.DEFAULT_SPACING
 
         theme = b"* {-GtkTreeView-vertical-separator: %d;" \
@@ -80,7 +91,8 @@ class RegisterScreen(Gtk.VBox):
         col = Gtk.TreeViewColumn(_('Category'), renderer)
         col.set_cell_data_func(renderer, self.category_render_cb)
         col.set_alignment(0.5)
-        col.set_min_width(300)
+        col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        col.set_fixed_width(300)
         self.treeview.append_column(col)
 
         renderer = Gtk.CellRendererText()
@@ -91,25 +103,30 @@ class RegisterScreen(Gtk.VBox):
         renderer.connect('edited', self.description_edit_cb)
         col = Gtk.TreeViewColumn(_('Description'), renderer)
         col.set_cell_data_func(renderer, self.description_render_cb)
+        col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
         col.set_expand(True)
         self.treeview.append_column(col)
 
         renderer = Gtk.CellRendererText()
         renderer.props.editable = True
         renderer.connect('edited', self.date_edit_cb)
+        renderer.props.xalign = 0.5
         col = Gtk.TreeViewColumn(_('Date'), renderer)
         col.set_alignment(0.5)
         col.set_cell_data_func(renderer, self.date_render_cb)
-        col.set_min_width(150)
+        col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        col.set_fixed_width(150)
         self.treeview.append_column(col)
 
         renderer = Gtk.CellRendererText()
         renderer.props.editable = True
         renderer.connect('edited', self.amount_edit_cb)
+        renderer.props.xalign = 1.0
         col = Gtk.TreeViewColumn(_('Amount'), renderer)
         col.set_cell_data_func(renderer, self.amount_render_cb)
         col.set_alignment(0.5)
-        col.set_min_width(120)
+        col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        col.set_fixed_width(120)
         renderer.props.xpad = style.DEFAULT_SPACING
         self.treeview.append_column(col)
 
@@ -119,17 +136,61 @@ class RegisterScreen(Gtk.VBox):
 
         self.pack_start(scroll, True, True, 0)
 
+        self._build_key = None
+        self._rows = {}
+
     def build(self):
-        # Build liststore.
-        self.liststore.clear()
-        for t in self.activity.visible_transactions:
-            self.liststore.append((t['id'],))
+        key = self.activity.get_view_key()
+        if key == self._build_key:
+            return
+        self._build_key = key
+
+        # Swap the rows while the view is detached, so that it only
+        # counts them once instead of handling a signal per row.
+        self.treeview.set_model(None)
+        self.model.set_ids(self.activity.visible_ids)
+        self.treeview.set_model(self.model)
+
+    def get_row(self, id):
+        """Return the formatted cells of a transaction.
+
+        Rows are cached by id along with the row version of the
+        transaction, so redrawing and scrolling format nothing until
+        the transaction changes.
+        """
+        store = self.activity.transaction_map
+        version = store.row_version(id)
+        row = self._rows.get(id)
+        if row is not None and row.version == version:
+            return row
+
+        t = store[id]
+        if t['type'] == 'credit':
+            amount = format_currency(t['amount'], False)
+            foreground = colors.CREDIT_COLOR
+        else:
+            amount = format_currency(-t['amount'], False)
+            foreground = colors.DEBIT_COLOR
+
+        category = t['category']
+        background = category_foreground = None
+        if category:
+            background = colors.get_category_color_str(category)
+            if not colors.is_too_light(background):
+                category_foreground = '#FFFFFF'
+
+        if len(self._rows) >= ROW_CACHE_SIZE:
+            self._rows.clear()
+        row = self._rows[id] = _Row(
+            version, t['name'],
+            datetime.date.fromordinal(t['date']).isoformat(), amount,
+            category, background, category_foreground, foreground)
+        return row
 
     def description_render_cb(self, column, cell_renderer, model, iter, data):
-        id = model.get_value(iter, 0)
-        t = self.activity.transaction_map[id]
-        cell_renderer.set_property('text', t['name'])
-        self._set_font_color(t, cell_renderer)
+        row = self.get_row(model.get_id(iter))
+        cell_renderer.set_property('text', row.name)
+        cell_renderer.set_property('foreground', row.foreground)
 
     def description_editing_started_cb(self, cell_renderer, editable, path):
         completion = Gtk.EntryCompletion()
@@ -137,7 +198,7 @@ class RegisterScreen(Gtk.VBox):
         completion.set_popup_completion(True)
         completion.set_minimum_key_length(0)
         store = Gtk.ListStore(str)
-        for c in list(self.activity.transaction_names.keys()):
+        for c in list(self.activity.ledger.transaction_names.keys()):
             store.append([c])
         completion.set_model(store)
         completion.set_text_column(0)
@@ -145,36 +206,26 @@ class RegisterScreen(Gtk.VBox):
         editable.set_max_length(50)
 
     def description_edit_cb(self, cell_renderer, path, new_text):
-        id = self.liststore[path][0]
-        t = self.activity.transaction_map[id]
-
-        self.add_to_undo(id, t)
-
-        t['name'] = new_text
-        # Automatically fill in category if empty, and if transaction
-        # name is known.
-        if t['category'] == '' and new_text in self.activity.transaction_names:
-            for ct in self.activity.data['transactions']:
-                if ct['name'] == new_text and ct['category'] != '':
-                    t['category'] = ct['category']
+        t = self.activity.transaction_map[self.model.get_id_at(path)]
+
+        with self.activity.ledger.undo_log.group():
+            t['name'] = new_text
+            # Automatically fill in category if empty, and if transaction
+            # name is known.
+            if t['category'] == '' and \
+                    new_text in self.activity.ledger.transaction_names:
+                t['category'] = \
+                    self.activity.transaction_map.last_category(new_text)
+        self.model.changed(path)
+        self.activity.build_undo_buttons()
 
     def amount_render_cb(self, column, cell_renderer, model, iter, data):
-        id = model.get_value(iter, -1)
-        t = self.activity.transaction_map[id]
-        cell_renderer.set_property('xalign', 1.0)
-        self._set_font_color(t, cell_renderer)
-        if t['type'] == 'credit':
-            cell_renderer.set_property('text',
-                                       locale.currency(t['amount'], False))
-        else:
-            cell_renderer.set_property('text',
-                                       locale.currency(-t['amount'], False))
+        row = self.get_row(model.get_id(iter))
+        cell_renderer.set_property('text', row.amount)
+        cell_renderer.set_property('foreground', row.foreground)
 
     def amount_edit_cb(self, cell_renderer, path, new_text):
-        id = self.liststore[path][0]
-        t = self.activity.transaction_map[id]
-
-        self.add_to_undo(id, t)
+        t = self.activity.transaction_map[self.model.get_id_at(path)]
 
         amount = evaluate(new_text)
         if amount is None:
@@ -182,46 +233,30 @@ class RegisterScreen(Gtk.VBox):
             return
 
         t['amount'] = abs(amount)
-        self.activity.update_summary()
+        self.model.changed(path)
+        self.activity.build_undo_buttons()
+        self.activity.invalidate(self.activity.DIRTY_SUMMARY)
 
     def date_render_cb(self, column, cell_renderer, model, iter, data):
-        id = model.get_value(iter, 0)
-        t = self.activity.transaction_map[id]
-        when = datetime.date.fromordinal(t['date'])
-        cell_renderer.set_property('text', when.isoformat())
-        cell_renderer.set_property('xalign', 0.5)
-        self._set_font_color(t, cell_renderer)
-
-    def _set_font_color(self, t, cell_renderer):
-        if t['type'] == 'credit':
-            cell_renderer.set_property('foreground', colors.CREDIT_COLOR)
-        else:
-            cell_renderer.set_property('foreground', colors.DEBIT_COLOR)
+        row = self.get_row(model.get_id(iter))
+        cell_renderer.set_property('text', row.date)
+        cell_renderer.set_property('foreground', row.foreground)
 
     def date_edit_cb(self, cell_renderer, path, new_text):
-        id = self.liststore[path][0]
-        t = self.activity.transaction_map[id]
-
-        self.add_to_undo(id, t)
+        t = self.activity.transaction_map[self.model.get_id_at(path)]
 
         when = time.strptime(new_text, "%Y-%m-%d")
         when = datetime.date(when[0], when[1], when[2])
         t['date'] = when.toordinal()
-        self.activity.build_visible_transactions()
-        self.activity.build_screen()
+        self.activity.build_undo_buttons()
+        dirty = self.activity.DIRTY_VISIBLE | self.activity.DIRTY_SUMMARY
+        self.activity.invalidate(dirty | self.activity.DIRTY_PANEL)
 
     def category_render_cb(self, column, cell_renderer, model, iter, data):
-        id = model.get_value(iter, 0)
-        t = self.activity.transaction_map[id]
-        category = t['category']
-        cell_renderer.set_property('text', category)
-        if category:
-            category_color = colors.get_category_color_str(category)
-            cell_renderer.set_property('background', category_color)
-            if not colors.is_too_light(category_color):
-                cell_renderer.set_property('foreground', '#FFFFFF')
-        else:
-            cell_renderer.set_property('background', None)
+        row = self.get_row(model.get_id(iter))
+        cell_renderer.set_property('text', row.category)
+        cell_renderer.set_property('background', row.category_background)
+        cell_renderer.set_property('foreground', row.category_foreground)
 
     def category_editing_started_cb(self, cell_renderer, editable, path):
         completion = Gtk.EntryCompletion()
@@ -229,7 +264,7 @@ class RegisterScreen(Gtk.VBox):
         completion.set_popup_completion(True)
         completion.set_minimum_key_length(0)
         store = Gtk.ListStore(str)
-        for c in list(self.activity.category_names.keys()):
+        for c in list(self.activity.ledger.category_names.keys()):
             store.append([c])
         completion.set_model(store)
         completion.set_text_column(0)
@@ -237,27 +272,29 @@ class RegisterScreen(Gtk.VBox):
         editable.set_max_length(20)
 
     def category_edit_cb(self, cell_renderer, path, new_text):
-        id = self.liststore[path][0]
-        t = self.activity.transaction_map[id]
-
-        self.add_to_undo(id, t)
+        t = self.activity.transaction_map[self.model.get_id_at(path)]
 
         t['category'] = new_text
         if new_text != '':
-            self.activity.category_names[new_text] = 1
+            self.activity.ledger.category_names[new_text] = 1
+        self.model.changed(path)
+        self.activity.build_undo_buttons()
 
     def new_credit(self):
+        # Flush any pending rebuild, it would cancel the editing below.
+        self.activity.rebuild()
         id = self.activity.create_transaction(_('New Credit'), 'credit', 0)
-        iter = self.liststore.append((id,))
+        iter = self.model.append(id)
         # Set cursor and begin editing the description.
-        self.treeview.set_cursor(self.liststore.get_path(iter),
+        self.treeview.set_cursor(self.model.get_path(iter),
                                  self.treeview.get_column(0), True)
 
     def new_debit(self):
+        self.activity.rebuild()
         id = self.activity.create_transaction(_('New Debit'), 'debit', 0)
-        iter = self.liststore.append((id,))
+        iter = self.model.append(id)
         # Set cursor and begin editing the description.
-        self.treeview.set_cursor(self.liststore.get_path(iter),
+        self.treeview.set_cursor(self.model.get_path(iter),
                                  self.treeview.get_column(0), True)
 
     def erase_item(self):
@@ -266,17 +303,15 @@ class RegisterScreen(Gtk.VBox):
         model, iterator = sel.get_selected()
         logging.debug('erase item %s', iterator)
         if iterator:
-            id = model.get_value(iterator, 0)
+            id = model.get_id(iterator)
             logging.debug('erase item id %s', id)
-            t = self.activity.transaction_map[id]
-
-            self.add_to_undo(id, t)
-
             self.activity.destroy_transaction(id)
-            self.activity.update_summary()
+            self.activity.build_undo_buttons()
+            dirty = self.activity.DIRTY_VISIBLE | self.activity.DIRTY_SUMMARY
+            self.activity.invalidate(dirty)
 
             path = model.get_path(iterator)
-            model.remove(iterator)
+            model.remove_row(path[0])
 
             # Select the next item, or else the last item.
             sel.select_path(path)
@@ -284,10 +319,3 @@ class RegisterScreen(Gtk.VBox):
                 row = path[0] - 1
                 if row >= 0:
                     sel.select_path((row,))
-
-    def add_to_undo(self, id, t):
-        self.activity.undo_id_map.append(id)
-        self.activity.undo_transaction_map.append(t.copy())
-        self.activity.redo_transaction_map = []
-        self.activity.redo_id_map = []
-        self.activity.build_undo_buttons()
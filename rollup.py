@@ -0,0 +1,186 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import standard Python modules.
+from ledgerstore import CREDIT
+from undolog import CREATE, ERASE, EXTEND
+
+# Fields whose changes move a transaction to another cell.
+_FIELDS = ('date', 'amount', 'type', 'category')
+
+# Positions in a cell.
+CREDIT_TOTAL = 0
+CREDIT_COUNT = 1
+DEBIT_TOTAL = 2
+DEBIT_COUNT = 3
+
+
+def _round(total):
+    # Removing amounts again leaves floating point dust behind.
+    return round(total, 6) + 0.0
+
+
+# Credit and debit totals and counts per time bucket and category.
+#
+# There is one level per kind of period, and each level maps the first
+# day of a bucket to {category: cell}, a cell being [credit total,
+# credit count, debit total, debit count]. buckets(date) returns the
+# bucket of every level a date ordinal falls in; its results are kept
+# in a lookup table, so the calendar math is done once per distinct day.
+#
+# The cube is built on the first query, with one pass over the rows for
+# the finest level and the others rolled up from it, and is then kept
+# up to date from the store listener calls, one cell per level for each
+# change. Transactions created together are added the way the cube is
+# built, with one pass over their rows.
+
+class Rollup:
+    def __init__(self, store, levels, buckets):
+        self.store = store
+        self.levels = levels
+        self._buckets = buckets
+        self._table = {}
+        self._cube = None
+        store.listeners.append(self.record)
+
+    @property
+    def built(self):
+        return self._cube is not None
+
+    def _lookup(self, date):
+        buckets = self._table.get(date)
+        if buckets is None:
+            buckets = self._table[date] = self._buckets(date)
+        return buckets
+
+    def _build(self):
+        self._cube = [{} for level in range(self.levels)]
+        self._add_slots(self.store.live_slots())
+
+    def _add_slots(self, slots):
+        store = self.store
+        dates = store.dates
+        amounts = store.amounts
+        types = store.types
+        categories = store.categories
+
+        # Cells of the finest level keyed by (date, category code).
+        days = {}
+        for slot in slots:
+            key = (dates[slot], categories[slot])
+            cell = days.get(key)
+            if cell is None:
+                cell = days[key] = [0.0, 0, 0.0, 0]
+            if types[slot] == CREDIT:
+                cell[CREDIT_TOTAL] += amounts[slot]
+                cell[CREDIT_COUNT] += 1
+            else:
+                cell[DEBIT_TOTAL] += amounts[slot]
+                cell[DEBIT_COUNT] += 1
+
+        category_table = store.category_table
+        for (date, code), day in days.items():
+            category = category_table[code]
+            for level, bucket in zip(self._cube, self._lookup(date)):
+                cells = level.get(bucket)
+                if cells is None:
+                    cells = level[bucket] = {}
+                cell = cells.get(category)
+                if cell is None:
+                    cells[category] = list(day)
+                else:
+                    for i in range(4):
+                        cell[i] += day[i]
+
+    def _update(self, t, sign):
+        if t['type'] == 'credit':
+            total, count = CREDIT_TOTAL, CREDIT_COUNT
+        else:
+            total, count = DEBIT_TOTAL, DEBIT_COUNT
+        category = t['category']
+        for level, bucket in zip(self._cube, self._lookup(t['date'])):
+            cells = level.get(bucket)
+            if cells is None:
+                cells = level[bucket] = {}
+            cell = cells.get(category)
+            if cell is None:
+                cell = cells[category] = [0.0, 0, 0.0, 0]
+            cell[total] += sign * t['amount']
+            cell[count] += sign
+            if cell[CREDIT_COUNT] == 0 and cell[DEBIT_COUNT] == 0:
+                del cells[category]
+                if not cells:
+                    del level[bucket]
+
+    def record(self, kind, id, field, old, new):
+        """Store listener, see LedgerStore."""
+        if self._cube is None:
+            return
+        if kind == EXTEND:
+            self._add_slots(self.store.slots(id))
+        elif kind == CREATE:
+            self._update(self.store.get_record(id), 1)
+        elif kind == ERASE:
+            self._update(old, -1)
+        elif field in _FIELDS:
+            t = self.store.get_record(id)
+            self._update(t, 1)
+            t[field] = old
+            self._update(t, -1)
+
+    def cells(self, level, bucket):
+        """Return {category: cell} of a bucket, which must not be
+        changed."""
+        if self._cube is None:
+            self._build()
+        return self._cube[level].get(bucket, {})
+
+    def totals(self, level, bucket):
+        """Return (credit_total, credit_count, debit_total, debit_count)
+        of a bucket."""
+        credit_total = debit_total = 0.0
+        credit_count = debit_count = 0
+        for cell in self.cells(level, bucket).values():
+            credit_total += cell[CREDIT_TOTAL]
+            credit_count += cell[CREDIT_COUNT]
+            debit_total += cell[DEBIT_TOTAL]
+            debit_count += cell[DEBIT_COUNT]
+        return (_round(credit_total), credit_count,
+                _round(debit_total), debit_count)
+
+    def series(self, level, credit):
+        """Return (bucket, {category: total}) pairs of the credits or
+        debits of every bucket of a level that has some, in bucket
+        order."""
+        if self._cube is None:
+            self._build()
+        cube = self._cube[level]
+        series = []
+        for bucket in sorted(cube):
+            totals = self.category_totals(level, bucket, credit)
+            if totals:
+                series.append((bucket, totals))
+        return series
+
+    def category_totals(self, level, bucket, credit):
+        """Return {category: total} of the credits or debits of a
+        bucket."""
+        if credit:
+            total, count = CREDIT_TOTAL, CREDIT_COUNT
+        else:
+            total, count = DEBIT_TOTAL, DEBIT_COUNT
+        return {category: _round(cell[total])
+                for category, cell in self.cells(level, bucket).items()
+                if cell[count]}
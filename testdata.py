@@ -0,0 +1,97 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Synthetic ledgers of any size, for testing and benchmarking."""
+
+# Import standard Python modules.
+import datetime
+import random
+
+# Debit categories with a typical amount, used before falling back to
+# numbered categories.
+DEBIT_CATEGORIES = (
+    ('Food', 25.0),
+    ('Housing', 500.0),
+    ('Transportation', 30.0),
+    ('Pets', 12.0),
+    ('Gifts', 25.0),
+    ('Health', 40.0),
+    ('Clothing', 35.0),
+    ('Utilities', 60.0),
+    ('School', 20.0),
+    ('Entertainment', 15.0),
+    ('Phone', 25.0),
+    ('Savings', 100.0),
+)
+
+CREDIT_CATEGORIES = (
+    ('Paycheck', 700.0),
+    ('Gift', 50.0),
+    ('Refund', 20.0),
+    ('Interest', 5.0),
+)
+
+# Distinct transaction names per category.
+NAMES_PER_CATEGORY = 8
+
+
+def _categories(base, count):
+    categories = list(base[:count])
+    for i in range(len(categories), count):
+        categories.append(('Category %d' % (i + 1), 10.0 * (i % 20 + 1)))
+    return categories
+
+
+def generate(count, seed=0, categories=12, days=3 * 365, credit_ratio=0.1,
+             end=None):
+    """Return count records for Ledger.create_transactions.
+
+    The records are spread over the given number of days ending at end
+    (today by default), in date order. About credit_ratio of them are
+    credits, categories is the number of debit categories. Amounts
+    follow a log-normal spread around a typical value per category, so
+    totals look like a household budget. The same seed always gives the
+    same ledger.
+    """
+    rng = random.Random(seed)
+    if end is None:
+        end = datetime.date.today()
+    first = end.toordinal() - days + 1
+
+    debit_categories = _categories(DEBIT_CATEGORIES, max(categories, 1))
+    credit_categories = list(CREDIT_CATEGORIES)
+
+    dates = sorted(first + rng.randrange(days) for i in range(count))
+
+    records = []
+    for date in dates:
+        if rng.random() < credit_ratio:
+            type = 'credit'
+            category, typical = rng.choice(credit_categories)
+        else:
+            type = 'debit'
+            category, typical = rng.choice(debit_categories)
+
+        name = '%s %d' % (category, rng.randrange(NAMES_PER_CATEGORY) + 1)
+        amount = round(typical * rng.lognormvariate(0, 0.5), 2)
+
+        records.append({
+            'name': name,
+            'type': type,
+            'amount': amount,
+            'date': datetime.date.fromordinal(date),
+            'category': category
+        })
+    return records
@@ -0,0 +1,223 @@
+# This file is part of Finance.
+#
+# Finance is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Finance is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Finance.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import standard Python modules.
+import collections
+import contextlib
+import sys
+import time
+
+# Change kinds reported by LedgerStore listeners.
+CREATE = 'create'
+ERASE = 'erase'
+SET = 'set'
+# Many transactions created at once, id is then the list of their ids.
+EXTEND = 'extend'
+
+# Default limits, oldest steps are dropped once either one is exceeded.
+MAX_STEPS = 1000
+MAX_BYTES = 1024 * 1024
+
+# Edits of the same field of the same transaction closer together than
+# this are merged into a single step.
+COALESCE_SECONDS = 2.0
+
+# Rough fixed cost of a change tuple, on top of the values it holds.
+_CHANGE_OVERHEAD = 120
+
+
+def _change_size(change):
+    kind, id, field, old, new = change
+    size = _CHANGE_OVERHEAD
+    for value in (old, new):
+        if isinstance(value, dict):
+            size += sum(sys.getsizeof(v) for v in value.values())
+        else:
+            size += sys.getsizeof(value)
+    return size
+
+
+class _Step:
+    __slots__ = ('changes', 'size', 'time')
+
+    def __init__(self):
+        self.changes = []
+        self.size = 0
+        self.time = time.monotonic()
+
+    def add(self, change):
+        self.changes.append(change)
+        self.size += _change_size(change)
+
+
+# Field level undo journal.
+#
+# Each step is the list of changes made by one user action: the field
+# that changed with its old and new value, the record of an erased
+# transaction, or just the id of a created one (its record is only
+# kept while the creation sits on the redo stack). Changes recorded
+# inside group() end up in the same step. The journal is bounded by a
+# number of steps and an estimated size in bytes, and forgets the
+# oldest steps first.
+
+class UndoLog:
+    def __init__(self, max_steps=MAX_STEPS, max_bytes=MAX_BYTES):
+        self.max_steps = max_steps
+        self.max_bytes = max_bytes
+
+        self._undo = collections.deque()
+        self._redo = []
+        self._bytes = 0
+        self._group = None
+        self._group_depth = 0
+        self._replaying = False
+
+    # Nothing can be undone or redone while a group is open, as its
+    # changes are not on the undo stack yet.
+    def can_undo(self):
+        return len(self._undo) > 0 and self._group is None
+
+    def can_redo(self):
+        return len(self._redo) > 0 and self._group is None
+
+    def clear(self):
+        self._undo.clear()
+        self._redo = []
+        self._bytes = 0
+
+    def begin_group(self):
+        if self._group_depth == 0:
+            self._group = _Step()
+        self._group_depth += 1
+
+    def end_group(self):
+        self._group_depth -= 1
+        if self._group_depth == 0:
+            step = self._group
+            self._group = None
+            if step.changes:
+                self._push(step)
+
+    @contextlib.contextmanager
+    def group(self):
+        self.begin_group()
+        try:
+            yield
+        finally:
+            self.end_group()
+
+    def record(self, kind, id, field=None, old=None, new=None):
+        """LedgerStore listener, called for every change."""
+        if self._replaying:
+            return
+        change = (kind, id, field, old, new)
+        self._redo = []
+
+        if kind == EXTEND:
+            step = self._group
+            if step is None:
+                step = _Step()
+            for created in id:
+                step.add((CREATE, created, None, None, None))
+            if step is not self._group:
+                self._push(step)
+            return
+
+        if self._group is not None:
+            self._group.add(change)
+            return
+
+        if kind == SET and self._undo:
+            last = self._undo[-1]
+            if len(last.changes) == 1 and \
+                    time.monotonic() - last.time < COALESCE_SECONDS:
+                last_kind, last_id, last_field, first_old, last_new = \
+                    last.changes[0]
+                if (last_kind, last_id, last_field) == (kind, id, field):
+                    self._bytes -= last.size
+                    last.changes = []
+                    last.size = 0
+                    last.add((kind, id, field, first_old, new))
+                    last.time = time.monotonic()
+                    self._bytes += last.size
+                    return
+
+        step = _Step()
+        step.add(change)
+        self._push(step)
+
+    def _push(self, step):
+        self._undo.append(step)
+        self._bytes += step.size
+        # The newest step is always kept, however large it is.
+        while len(self._undo) > 1:
+            if len(self._undo) <= self.max_steps and \
+                    self._bytes <= self.max_bytes:
+                break
+            self._bytes -= self._undo.popleft().size
+
+    def undo(self, store):
+        if not self.can_undo():
+            return False
+        step = self._undo.pop()
+        self._bytes -= step.size
+        if self._undo:
+            # Never merge later edits into a step from before the undo.
+            self._undo[-1].time = 0
+
+        redo_step = _Step()
+        self._replaying = True
+        try:
+            for change in reversed(step.changes):
+                kind, id, field, old, new = change
+                if kind == SET:
+                    store.set_field(id, field, old)
+                elif kind == CREATE:
+                    change = (kind, id, field, old, store.get_record(id))
+                    store.remove(id)
+                elif kind == ERASE:
+                    store.insert(old)
+                redo_step.add(change)
+        finally:
+            self._replaying = False
+
+        redo_step.changes.reverse()
+        self._redo.append(redo_step)
+        return True
+
+    def redo(self, store):
+        if not self.can_redo():
+            return False
+        step = self._redo.pop()
+
+        undo_step = _Step()
+        self._replaying = True
+        try:
+            for change in step.changes:
+                kind, id, field, old, new = change
+                if kind == SET:
+                    store.set_field(id, field, new)
+                elif kind == CREATE:
+                    store.insert(new)
+                    change = (kind, id, field, old, None)
+                elif kind == ERASE:
+                    store.remove(id)
+                undo_step.add(change)
+        finally:
+            self._replaying = False
+
+        undo_step.time = 0
+        self._push(undo_step)
+        return True